@@ -42,8 +42,8 @@ possible only via inverting of the geometry function, which is a fundamentally
 expensive and currently unsupported operation.
 """
 
-from . import util, types, numeric, cache, transform, transformseq, expression, warnings
-import numpy, sys, itertools, functools, operator, inspect, numbers, builtins, re, types as builtin_types, abc, collections.abc, math, treelog as log
+from . import util, types, numeric, cache, transform, transformseq, expression, warnings, parallel
+import numpy, sys, itertools, functools, operator, inspect, numbers, builtins, re, types as builtin_types, abc, collections.abc, math, time, contextlib, treelog as log
 _ = numpy.newaxis
 
 isevaluable = lambda arg: isinstance(arg, Evaluable)
@@ -81,7 +81,13 @@ class Evaluable(types.Singleton):
   'Base class'
 
   __slots__ = '__args',
-  __cache__ = 'dependencies', 'ordereddeps', 'dependencytree', 'simplified', 'prepare_eval', 'optimized_for_numpy'
+  __cache__ = 'dependencies', 'ordereddeps', 'dependencytree', 'simplified', 'prepare_eval', 'optimized_for_numpy', '_elementdependent', '_lastuses', 'compiled'
+
+  # Positions of the evalf arguments that may carry a leading axis spanning
+  # several elements in :meth:`eval_batched`. Operations that treat the
+  # leading (points) axis strictly pointwise list all their array arguments;
+  # all other operations are evaluated element by element.
+  _batchargs = ()
 
   @types.apply_annotations
   def __init__(self, args:types.tuple[strictevaluable]):
@@ -151,14 +157,30 @@ class Evaluable(types.Singleton):
   def __str__(self):
     return self.__class__.__name__
 
+  @property
+  def _lastuses(self):
+    '''for all operations in ``serialized`` the indices of the values that are
+    used for the last time by the operation, see :func:`_lastuses`'''
+
+    return _lastuses(indices for op, indices in self.serialized)
+
   def eval(self, **evalargs):
-    '''Evaluate function on a specified element, point set.'''
+    '''Evaluate function on a specified element, point set.
+
+    Intermediate values are released as soon as no later operation needs
+    them, which limits the peak memory to that of the live values.'''
 
+    profile = _profile
     values = [evalargs]
-    for op, indices in self.serialized:
+    for (op, indices), lastuses in zip(self.serialized, self._lastuses):
       try:
         args = [values[i] for i in indices]
-        retval = op.evalf(*args)
+        if profile is None:
+          retval = op.evalf(*args)
+        else:
+          t0 = time.perf_counter()
+          retval = op.evalf(*args)
+          profile.record(op, time.perf_counter() - t0, retval)
       except KeyboardInterrupt:
         raise
       except:
@@ -166,18 +188,106 @@ class Evaluable(types.Singleton):
         excargs = etype, evalue, self, values
         raise EvaluationError(*excargs).with_traceback(traceback)
       values.append(retval)
+      for i in lastuses:
+        values[i] = None
     return values[-1]
 
+  @property
+  def compiled(self):
+    '''Compiled evaluation plan.
+
+    The :class:`EvaluationPlan` of this function with generated source, which
+    is created once and reused for as long as this function is alive. Calling
+    the plan with evaluation arguments is equivalent to :meth:`eval`.'''
+
+    return EvaluationPlan(self)
+
+  @property
+  def _elementdependent(self):
+    '''flags for all operations in ``serialized`` that depend on the element
+    transforms, i.e. that cannot be shared between elements in a batch'''
+
+    # SelectChain is the only evaluable that reads the per-element
+    # `_transforms` evaluation argument.
+    flags = [False]
+    for op, indices in self.serialized:
+      flags.append(isinstance(op, SelectChain) or any(flags[i] for i in indices))
+    return tuple(flags[1:])
+
+  def eval_batched(self, _transforms, **evalargs):
+    '''Evaluate function on a batch of elements that share a point set.
+
+    The result is equivalent to ``[self.eval(_transforms=t, **evalargs) for t
+    in _transforms]``, but operations that do not depend on the element are
+    evaluated only once, and operations that act pointwise on arrays are
+    evaluated once for the entire batch by stacking the points of all elements
+    along the leading axis. All other operations fall back to element-by-element
+    evaluation.
+
+    Args
+    ----
+    _transforms : :class:`tuple` of transform chains
+        Per element, the transforms that would otherwise be passed to
+        :meth:`eval` as ``_transforms``.
+    **evalargs :
+        Evaluation arguments shared by all elements, including ``_points``.
+
+    Returns
+    -------
+    :class:`list`
+        Per element the value of this function.
+    '''
+
+    with bufferpool(False): # values of different elements must not share buffers
+      return self._eval_batched(_transforms, evalargs)
+
+  def _eval_batched(self, _transforms, evalargs):
+    nelems = len(_transforms)
+    perelem = [dict(evalargs, _transforms=transforms) for transforms in _transforms]
+    # Every value is stored as a (kind, value) pair, where kind is one of
+    # _SHARED (a single value for all elements), _PERELEM (a list with one
+    # value per element) or _STACKED (an array with a leading element axis).
+    values = [(_SHARED, perelem[0] if perelem else evalargs)]
+    for (op, indices), elementdependent, lastuses in zip(self.serialized, self._elementdependent, self._lastuses):
+      try:
+        args = [values[i] for i in indices]
+        if not elementdependent:
+          retval = _SHARED, op.evalf(*[value for kind, value in args])
+        elif isinstance(op, SelectChain):
+          retval = _PERELEM, [op.evalf(evalargs) for evalargs in perelem]
+        else:
+          retval = _evalf_batched(op, args, nelems)
+      except KeyboardInterrupt:
+        raise
+      except:
+        etype, evalue, traceback = sys.exc_info()
+        excargs = etype, evalue, self, values
+        raise EvaluationError(*excargs).with_traceback(traceback)
+      values.append(retval)
+      for i in lastuses:
+        values[i] = None
+    return _unbatch(*values[-1], nelems)
+
   @log.withcontext
-  def graphviz(self, dotpath='dot', imgtype='png'):
-    'create function graph'
+  def graphviz(self, dotpath='dot', imgtype='png', profile=None):
+    '''create function graph
+
+    If a :class:`Profile` is given, every node is annotated with its number of
+    calls, cumulative evaluation time and output size, and shaded in
+    proportion to its share of the total evaluation time.'''
 
     import os, subprocess
 
+    ops = self.ordereddeps+(self,)
     lines = []
     lines.append('digraph {')
     lines.append('graph [dpi=72];')
-    lines.extend('{0:} [label="{0:}. {1:}"];'.format(i, name._asciitree_str()) for i, name in enumerate(self.ordereddeps+(self,)))
+    if profile is None:
+      lines.extend('{0:} [label="{0:}. {1:}"];'.format(i, name._asciitree_str()) for i, name in enumerate(ops))
+    else:
+      stats = [profile.stats.get(op, (0, 0., 0)) for op in ops]
+      maxtime = builtins.max(t for n, t, b in stats) or 1.
+      lines.extend('{0:} [label="{0:}. {1:}\\n{2:} calls, {3:.3g}s, {4:}" style=filled fillcolor="0 {5:.3f} 1"];'.format(i, name._asciitree_str(), n, t, _nbytesstr(b), t/maxtime) for i, (name, (n, t, b)) in enumerate(zip(ops, stats)))
     lines.extend('{} -> {};'.format(j, i) for i, indices in enumerate(self.dependencytree) for j in indices)
     lines.append('}')
 
@@ -241,6 +351,354 @@ class EvaluationError(Exception):
 
     return '\n{} --> {}: {}'.format(self.evaluable.stackstr(nlines=len(self.values)), self.etype.__name__, self.evalue)
 
+class EvaluationPlan:
+  '''Reusable evaluation plan of an :class:`Evaluable`.
+
+  The plan resolves the serialized operations of a function once into a flat
+  list of instructions, each consisting of an ``evalf`` callable and the slot
+  indices of its arguments. If ``cse`` is true (default) operations that are
+  not identical but are guaranteed to evaluate to the same value are merged
+  into a single instruction; the number of merged operations is available as
+  the ``merged`` attribute. If ``codegen`` is true (default) the instructions
+  are additionally translated into the source of a single Python function,
+  available as the ``source`` attribute, which removes all interpretation
+  overhead from evaluation. Calling the plan with evaluation arguments is
+  equivalent to :meth:`Evaluable.eval`, also in raising
+  :class:`EvaluationError` on failure.
+
+  Args
+  ----
+  evaluable : :class:`Evaluable`
+      Function to be evaluated, typically simplified and optimized.
+  codegen : :class:`bool`
+      Generate Python source for the plan.
+  cse : :class:`bool`
+      Merge common subexpressions.
+  '''
+
+  __slots__ = 'evaluable', 'ops', 'instructions', 'merged', 'source', '_codegen', '_result', '_evaluate', '_cached'
+
+  def __init__(self, evaluable, codegen=True, cse=True):
+    self.evaluable = evaluable
+    serialized = tuple(evaluable.serialized)
+    if cse:
+      self.ops, self.instructions, self._result = _merge_common_subexpressions(serialized)
+    else:
+      self.ops = tuple(op for op, indices in serialized)
+      self.instructions = tuple((op.evalf, indices) for op, indices in serialized)
+      self._result = len(self.instructions)
+    self.merged = len(serialized) - len(self.instructions)
+    self._codegen = codegen
+    self._evaluate, self.source = self._build(enumerate(self.instructions, start=1))
+    self._cached = None
+
+  def _build(self, program, load=None, store=None):
+    # Returns a callable that, unless `load` is None, loads the values of the
+    # slots in `load` from its second argument, runs `program`, a sequence
+    # of slot and instruction pairs, and returns the result, followed by the
+    # values of the slots in `store` unless `store` is None. Intermediate
+    # values are released after their last use. The second return value is
+    # the generated source, if any.
+    program = tuple(program)
+    lastuses = _lastuses((indices for slot, (evalf, indices) in program), keep=(self._result,)+tuple(store or ()))
+    if not self._codegen:
+      def evaluate(evalargs, loaded=()):
+        values = dict(zip(load or (), loaded))
+        values[0] = evalargs
+        for (slot, (evalf, indices)), free in zip(program, lastuses):
+          values[slot] = evalf(*[values[i] for i in indices])
+          for i in free:
+            del values[i]
+        result = values[self._result]
+        return result if store is None else (result, tuple(values[i] for i in store))
+      return evaluate, None
+    lines = ['def evaluate(v0):' if load is None else 'def evaluate(v0, loaded):']
+    if load:
+      lines.append('  {}, = loaded'.format(', '.join('v{}'.format(i) for i in load)))
+    for (slot, (evalf, indices)), free in zip(program, lastuses):
+      lines.append('  v{} = f{}({})'.format(slot, slot, ', '.join('v{}'.format(i) for i in indices)))
+      if free:
+        lines.append('  del {}'.format(', '.join('v{}'.format(i) for i in free)))
+    if store is None:
+      lines.append('  return v{}'.format(self._result))
+    else:
+      lines.append('  return v{}, ({})'.format(self._result, ''.join('v{}, '.format(i) for i in store)))
+    source = '\n'.join(lines)
+    namespace = {'f{}'.format(slot): evalf for slot, (evalf, indices) in program}
+    exec(compile(source, '<{}>'.format(type(self).__name__), 'exec'), namespace)
+    return namespace['evaluate'], source
+
+  def _split(self):
+    # Mark the slots that depend on the element (via `Points` or
+    # `SelectChain`) but not on any other evaluation argument, and select
+    # those among them that are consumed by the remaining operations.
+    elemdep = [True]
+    volatile = [False]
+    for op, (evalf, indices) in zip(self.ops, self.instructions):
+      elemdep.append(any(elemdep[i] for i in indices))
+      volatile.append(not isinstance(op, (Points, SelectChain)) if 0 in indices else any(volatile[i] for i in indices))
+    cacheable = [slot > 0 and elemdep[slot] and not volatile[slot] for slot in range(len(elemdep))]
+    needed = {self._result}
+    stored = []
+    for slot in reversed(range(1, len(self.instructions)+1)):
+      if slot not in needed:
+        continue
+      if cacheable[slot]:
+        stored.append(slot)
+      else:
+        needed.update(self.instructions[slot-1][1])
+    stored.reverse()
+    store, source = self._build(enumerate(self.instructions, start=1), store=stored)
+    reuse, source = self._build(((slot, self.instructions[slot-1]) for slot in sorted(needed - {0}) if not cacheable[slot]), load=stored)
+    return store, reuse
+
+  def __call__(self, **evalargs):
+    try:
+      return self._evaluate(evalargs)
+    except KeyboardInterrupt:
+      raise
+    except Exception:
+      # Repeat the evaluation step by step to locate the failing operation.
+      self.evaluable.eval(**evalargs)
+      raise
+
+  def eval_cached(self, cache, key, **evalargs):
+    '''Evaluate while reusing argument independent values.
+
+    The values of all operations that depend on the element, through the
+    ``_transforms`` and ``_points`` evaluation arguments, but not on any other
+    evaluation argument, are stored in ``cache`` under ``key`` and reused in
+    subsequent evaluations with the same key, such that only the argument
+    dependent part of the function is evaluated again. The caller is
+    responsible for ``key`` to uniquely identify transforms and points.
+
+    Args
+    ----
+    cache : mapping
+        Storage for the argument independent values.
+    key : hashable
+        Cache key identifying the element.
+    **evalargs
+        Evaluation arguments, as for :meth:`__call__`.
+    '''
+
+    if self._cached is None:
+      self._cached = self._split()
+    store, reuse = self._cached
+    try:
+      try:
+        stored = cache[key]
+      except KeyError:
+        with bufferpool(False): # stored values outlive the evaluation
+          retval, cache[key] = store(evalargs)
+        return retval
+      return reuse(evalargs, stored)
+    except KeyboardInterrupt:
+      raise
+    except Exception:
+      self.evaluable.eval(**evalargs)
+      raise
+
+class Profile:
+  '''Evaluation statistics per operation.
+
+  While active, see :func:`profile`, every operation that is evaluated by
+  :meth:`Evaluable.eval` records its number of calls, the cumulative wall time
+  of its ``evalf`` and the cumulative size in bytes of its return values. The
+  statistics are available per operation via :attr:`stats` and aggregated per
+  class via :attr:`byclass`.
+  '''
+
+  def __init__(self):
+    self.stats = {} # op -> [ncalls, time, nbytes]
+
+  def record(self, op, seconds, retval):
+    stats = self.stats.get(op)
+    if stats is None:
+      stats = self.stats[op] = [0, 0., 0]
+    stats[0] += 1
+    stats[1] += seconds
+    if numeric.isarray(retval):
+      stats[2] += numpy.asarray(retval).nbytes
+
+  @property
+  def byclass(self):
+    byclass = {}
+    for op, (ncalls, seconds, nbytes) in self.stats.items():
+      stats = byclass.setdefault(type(op).__name__, [0, 0., 0])
+      stats[0] += ncalls
+      stats[1] += seconds
+      stats[2] += nbytes
+    return byclass
+
+  def log(self, nnodes=10):
+    '''Log the statistics per class and of the ``nnodes`` most expensive
+    operations as tables, sorted by cumulative evaluation time.'''
+
+    if not self.stats:
+      log.info('no evaluations were recorded')
+      return
+    total = builtins.sum(seconds for ncalls, seconds, nbytes in self.stats.values())
+    log.info('evaluation time per class:\n' + _profiletable(self.byclass.items(), total))
+    nodes = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)[:nnodes]
+    log.info('evaluation time of the {} most expensive operations:\n'.format(len(nodes)) + _profiletable(((op._asciitree_str(), stats) for op, stats in nodes), total))
+
+def _profiletable(rows, total):
+  rows = sorted(rows, key=lambda item: item[1][1], reverse=True)
+  width = builtins.max(len(name) for name, stats in rows)
+  lines = ['{:<{}}  {:>9}  {:>9}  {:>6}  {:>9}'.format('operation', width, 'calls', 'time', 'share', 'output')]
+  lines.extend('{:<{}}  {:>9}  {:>8.3f}s  {:>5.1f}%  {:>9}'.format(name, width, ncalls, seconds, 100*seconds/total if total else 0, _nbytesstr(nbytes)) for name, (ncalls, seconds, nbytes) in rows)
+  return '\n'.join(lines)
+
+def _nbytesstr(nbytes):
+  for unit in 'B', 'KiB', 'MiB', 'GiB':
+    if nbytes < 1024 or unit == 'GiB':
+      return '{:.0f}{}'.format(nbytes, unit) if unit == 'B' else '{:.1f}{}'.format(nbytes, unit)
+    nbytes /= 1024
+
+_profile = None
+
+_bufferpool = None
+
+@contextlib.contextmanager
+def bufferpool(enable=True):
+  '''Reuse output buffers across evaluations.
+
+  Within this context, operations that allocate their return value, such as
+  :class:`Einsum`, :class:`Inflate` and :class:`Diagonalize`, write into a
+  buffer that is kept per operation, shape and dtype, and that is reused by
+  subsequent evaluations. Consequently, every evaluated value is valid only
+  until the next evaluation of the same function, and must be consumed or
+  copied before that. Samples enable the pool for element loops in which this
+  is the case. Setting ``enable`` to false disables the pool of an enclosing
+  context for evaluations whose values are retained.
+
+  Args
+  ----
+  enable : :class:`bool`
+      Enable or disable reuse of buffers.
+  '''
+
+  global _bufferpool
+  old = _bufferpool
+  _bufferpool = {} if enable else None
+  try:
+    yield
+  finally:
+    _bufferpool = old
+
+def _empty(op, shape, dtype):
+  '''Uninitialized array for the return value of ``op``, taken from the
+  buffer pool if enabled.'''
+
+  pool = _bufferpool
+  if pool is None:
+    return numpy.empty(shape, dtype)
+  key = op, tuple(shape), numpy.dtype(dtype)
+  buf = pool.get(key)
+  if buf is None:
+    buf = pool[key] = numpy.empty(shape, dtype)
+  return buf
+
+def _zeros(op, shape, dtype):
+  '''Zero array for the return value of ``op``, taken from the buffer pool if
+  enabled.'''
+
+  if _bufferpool is None:
+    return numpy.zeros(shape, dtype)
+  buf = _empty(op, shape, dtype)
+  buf.fill(0)
+  return buf
+
+@contextlib.contextmanager
+def profile(nnodes=10):
+  '''Profile function evaluations.
+
+  Record the statistics of all operations that are evaluated within the
+  context in a new :class:`Profile`, which is returned, and log them as tables
+  upon exit. Samples evaluate via :meth:`Evaluable.eval` while profiling, and
+  forking is disabled such that evaluations in all elements are recorded::
+
+      with function.profile() as prof:
+        A = domain.integrate(integrand, degree=2)
+
+  Args
+  ----
+  nnodes : :class:`int`
+      Number of most expensive operations to be logged individually.
+  '''
+
+  global _profile
+  old = _profile
+  _profile = Profile()
+  try:
+    with parallel.maxprocs(1):
+      yield _profile
+  finally:
+    prof, _profile = _profile, old
+  prof.log(nnodes)
+
+def _lastuses(program, keep=()):
+  '''Last use of values in a serialized program.
+
+  For a sequence of operations, given as the tuples of indices of the values
+  that they consume, return per operation the sorted indices of the values
+  that are not consumed by any later operation. Index 0, the evaluation
+  arguments, and the indices in ``keep`` are never included.'''
+
+  used = {0, *keep}
+  lastuses = []
+  for indices in reversed(tuple(program)):
+    lastuses.append(tuple(sorted(set(indices) - used)))
+    used.update(indices)
+  return tuple(reversed(lastuses))
+
+def _merge_common_subexpressions(serialized):
+  '''Merge equivalent operations in a serialized evaluable.
+
+  Singleton construction already unifies operations with identical
+  arguments. In addition, two operations are merged if their ``evalf`` is
+  not bound to the instance and they act on the same slots, or if they are
+  of the same type and their arguments are identical up to operations that
+  were merged before. Returns the remaining operations, their instructions
+  with renumbered slots, and the slot of the final result.'''
+
+  ops = []
+  instructions = []
+  slots = [0] # serialized index -> slot
+  opslots = {EVALARGS: 0}
+  keys = {}
+  for op, indices in serialized:
+    indices = tuple(slots[i] for i in indices)
+    key = _cse_key(op, indices, opslots)
+    try:
+      slot = keys[key]
+    except KeyError:
+      ops.append(op)
+      instructions.append((op.evalf, indices))
+      slot = keys[key] = len(instructions)
+    slots.append(slot)
+    opslots[op] = slot
+  return tuple(ops), tuple(instructions), slots[-1]
+
+def _cse_key(op, indices, opslots):
+  if getattr(op.evalf, '__self__', None) is not op:
+    return op.evalf, indices
+  def canonical(arg):
+    if isinstance(arg, Evaluable):
+      return (Evaluable, opslots[arg]) if arg in opslots else arg
+    if isinstance(arg, tuple):
+      return tuple(map(canonical, arg))
+    if isinstance(arg, types.frozenmultiset):
+      return types.frozenmultiset(map(canonical, arg))
+    return arg
+  key = type(op), canonical(op._args), tuple((name, canonical(value)) for name, value in sorted(op._kwargs.items()))
+  try:
+    hash(key)
+  except TypeError:
+    return op
+  return key
+
 EVALARGS = Evaluable(args=())
 
 class Points(Evaluable):
@@ -638,6 +1096,7 @@ class Normal(Array):
   'normal'
 
   __slots__ = 'lgrad',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, lgrad:asarray):
@@ -765,6 +1224,7 @@ class InsertAxis(Array):
 
   __slots__ = 'func', 'axis', 'length'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint, length:asarray):
@@ -888,6 +1348,7 @@ class Transpose(Array):
 
   __slots__ = 'func', 'axes'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axes:types.tuple[types.strictint]):
@@ -987,6 +1448,7 @@ class Get(Array):
 
   __slots__ = 'func', 'axis', 'item'
   __cache__ = 'simplified',
+  _batchargs = 0, 1
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint, item:asarray):
@@ -1032,6 +1494,7 @@ class Product(Array):
 
   __slots__ = 'func',
   __cache__ = 'simplified',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray):
@@ -1113,6 +1576,7 @@ class Inverse(Array):
 
   __slots__ = 'func',
   __cache__ = 'simplified',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray):
@@ -1169,6 +1633,7 @@ class Concatenate(Array):
 
   __slots__ = 'funcs', 'axis'
   __cache__ = '_withslices', 'simplified', 'blocks'
+  _batchargs = property(lambda self: range(len(self.funcs)))
 
   @types.apply_annotations
   def __init__(self, funcs:types.tuple[asarray], axis:types.strictint=0):
@@ -1216,7 +1681,7 @@ class Concatenate(Array):
   def evalf(self, *arrays):
     shape = list(builtins.max(arrays, key=len).shape)
     shape[self.axis+1] = builtins.sum(array.shape[self.axis+1] for array in arrays)
-    retval = numpy.empty(shape, dtype=self.dtype)
+    retval = _empty(self, shape, dtype=self.dtype)
     n0 = 0
     for array in arrays:
       n1 = n0 + array.shape[self.axis+1]
@@ -1318,6 +1783,7 @@ class Interpolate(Array):
   'interpolate uniformly spaced data; stepwise for now'
 
   __slots__ = 'xp', 'fp', 'left', 'right'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, x:asarray, xp:types.frozenarray, fp:types.frozenarray, left:types.strictfloat=None, right:types.strictfloat=None):
@@ -1338,6 +1804,7 @@ class Determinant(Array):
 
   __slots__ = 'func',
   __cache__ = 'simplified',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray):
@@ -1381,6 +1848,7 @@ class Multiply(Array):
 
   __slots__ = 'funcs',
   __cache__ = 'simplified', 'optimized_for_numpy', 'blocks'
+  _batchargs = 0, 1
 
   @types.apply_annotations
   def __init__(self, funcs:types.frozenmultiset[asarray]):
@@ -1531,6 +1999,7 @@ class Add(Array):
 
   __slots__ = 'funcs',
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0, 1
 
   @types.apply_annotations
   def __init__(self, funcs:types.frozenmultiset[asarray]):
@@ -1601,7 +2070,12 @@ class Add(Array):
 
 class Einsum(Array):
 
-  __slots__ = 'func1', 'func2', 'mask', '_einsumfmt'
+  __slots__ = 'func1', 'func2', 'mask', '_einsumfmt', '_matmul'
+  _batchargs = 0, 1
+
+  # Minimum number of multiplications per point for contractions to be
+  # evaluated via matmul rather than einsum.
+  _matmulsize = 64
 
   @types.apply_annotations
   def __init__(self, func1:asarray, func2:asarray, mask:types.tuple[types.strictint]):
@@ -1623,15 +2097,72 @@ class Einsum(Array):
     assert i1 == func1.ndim and i2 == func2.ndim
     axes = [(chr(ord('a')+i+1), m) for i, m in enumerate(mask)]
     self._einsumfmt = 'a{},a{}->a{}'.format(*[''.join(c for c, m in axes if m != ex) for ex in (2,1,0)])
+    self._matmul = self._matmulpath(mask) if 0 in mask else None
     super().__init__(args=[func1, func2], shape=shape, dtype=_jointdtype(func1.dtype, func2.dtype))
 
+  @staticmethod
+  def _matmulpath(mask):
+    # Contraction path that maps the einsum onto a (batched) matrix product:
+    # func1 is transposed to batch, free and contracted axes, func2 to batch,
+    # contracted and free axes, such that after flattening each group the
+    # product of the last two axes forms the contraction. Returned are the
+    # transpositions of both arguments (including the leading points axis),
+    # the number of batch, free1 and free2 axes, and the transposition of the
+    # product to the axis order of the result.
+    batch, free1, free2, contracted = [], [], [], []
+    i1 = i2 = 1
+    for m in mask:
+      if m == 3:
+        batch.append((i1, i2))
+      elif m == 1:
+        free1.append(i1)
+      elif m == 2:
+        free2.append(i2)
+      else:
+        contracted.append((i1, i2))
+      i1 += m != 2
+      i2 += m != 1
+    trans1 = (0, *[i for i, j in batch], *free1, *[i for i, j in contracted])
+    trans2 = (0, *[j for i, j in batch], *[j for i, j in contracted], *free2)
+    ib = iter(range(1, len(batch)+1))
+    i1 = iter(range(len(batch)+1, len(batch)+len(free1)+1))
+    i2 = iter(range(len(batch)+len(free1)+1, len(batch)+len(free1)+len(free2)+1))
+    outtrans = (0, *[next(ib) if m == 3 else next(i1) if m == 1 else next(i2) for m in mask if m])
+    return trans1, trans2, len(batch), len(free1), len(free2), outtrans
+
   def evalf(self, arr1, arr2):
-    return numpy.core.multiarray.c_einsum(self._einsumfmt, arr1, arr2)
+    if self._matmul:
+      trans1, trans2, nbatch, nfree1, nfree2, outtrans = self._matmul
+      arr1 = arr1.transpose(trans1)
+      arr2 = arr2.transpose(trans2)
+      batch = arr1.shape[1:1+nbatch]
+      free1 = arr1.shape[1+nbatch:1+nbatch+nfree1]
+      free2 = arr2.shape[arr2.ndim-nfree2:]
+      n1 = functools.reduce(operator.mul, free1, 1)
+      n2 = functools.reduce(operator.mul, free2, 1)
+      nc = arr1[(0,)*(1+nbatch+nfree1)].size
+      if n1 * n2 * nc >= self._matmulsize:
+        shape = builtins.max(len(arr1), len(arr2)), functools.reduce(operator.mul, batch, 1), n1, n2
+        out = _empty(self, shape, numpy.result_type(arr1, arr2))
+        numpy.matmul(arr1.reshape(len(arr1), shape[1], n1, nc), arr2.reshape(len(arr2), shape[1], nc, n2), out=out)
+        return out.reshape((shape[0],)+batch+free1+free2).transpose(outtrans)
+      arr1 = arr1.transpose(numpy.argsort(trans1))
+      arr2 = arr2.transpose(numpy.argsort(trans2))
+    if _bufferpool is None:
+      return numpy.core.multiarray.c_einsum(self._einsumfmt, arr1, arr2)
+    args, result = self._einsumfmt.split('->')
+    lengths = {}
+    for arg, arr in zip(args.split(','), (arr1, arr2)):
+      for c, n in zip(arg, arr.shape):
+        lengths[c] = builtins.max(lengths.get(c, 1), n)
+    out = _empty(self, [lengths[c] for c in result], numpy.result_type(arr1, arr2))
+    return numpy.core.multiarray.c_einsum(self._einsumfmt, arr1, arr2, out=out)
 
 class Sum(Array):
 
   __slots__ = 'axis', 'func'
   __cache__ = 'simplified', 'optimized_for_numpy', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint):
@@ -1685,6 +2216,7 @@ class TakeDiag(Array):
 
   __slots__ = 'func', 'axis', 'rmaxis'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint, rmaxis:types.strictint):
@@ -1762,6 +2294,7 @@ class Take(Array):
 
   __slots__ = 'func', 'axis', 'indices'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, indices:asarray, axis:types.strictint):
@@ -1839,6 +2372,7 @@ class Power(Array):
 
   __slots__ = 'func', 'power'
   __cache__ = 'simplified',
+  _batchargs = 0, 1
 
   @types.apply_annotations
   def __init__(self, func:asarray, power:asarray):
@@ -1908,6 +2442,7 @@ class Pointwise(Array):
 
   __slots__ = 'args',
   __cache__ = 'simplified',
+  _batchargs = 0, 1
 
   deriv = None
 
@@ -2037,6 +2572,7 @@ class Sign(Array):
 
   __slots__ = 'func',
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray):
@@ -2203,7 +2739,7 @@ class Zeros(Array):
   def evalf(self, *shape):
     if shape:
       shape, = zip(*shape)
-    return numpy.zeros((1,)+shape, dtype=self.dtype)
+    return _zeros(self, (1,)+shape, dtype=self.dtype)
 
   @property
   def blocks(self):
@@ -2269,6 +2805,7 @@ class Inflate(Array):
 
   __slots__ = 'func', 'dofmap', 'length', 'axis'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, dofmap:asarray, length:types.strictint, axis:types.strictint):
@@ -2298,7 +2835,7 @@ class Inflate(Array):
     warnings.warn('using explicit inflation; this is usually a bug.', ExpensiveEvaluationWarning)
     shape = list(array.shape)
     shape[self.axis+1] = self.length
-    inflated = numpy.zeros(shape, dtype=self.dtype)
+    inflated = _zeros(self, shape, dtype=self.dtype)
     numpy.add.at(inflated, (slice(None),)*(self.axis+1)+(indices,), array)
     return inflated
 
@@ -2403,6 +2940,7 @@ class Diagonalize(Array):
 
   __slots__ = 'func', 'axis', 'newaxis'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis=types.strictint, newaxis=types.strictint):
@@ -2425,7 +2963,8 @@ class Diagonalize(Array):
 
   def evalf(self, arr):
     assert arr.ndim == self.ndim
-    return numeric.diagonalize(arr, self.axis+1, self.newaxis+1)
+    shape = arr.shape[:self.newaxis+1] + (arr.shape[self.axis+1],) + arr.shape[self.newaxis+1:]
+    return numeric.diagonalize(arr, self.axis+1, self.newaxis+1, out=_empty(self, shape, arr.dtype))
 
   def _derivative(self, var, seen):
     return diagonalize(derivative(self.func, var, seen), self.axis, self.newaxis)
@@ -2535,6 +3074,7 @@ class Guard(Array):
   'bar all simplifications'
 
   __slots__ = 'fun',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, fun:asarray):
@@ -2556,6 +3096,7 @@ class TrigNormal(Array):
   'cos, sin'
 
   __slots__ = 'angle',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, angle:asarray):
@@ -2573,6 +3114,7 @@ class TrigTangent(Array):
   '-sin, cos'
 
   __slots__ = 'angle',
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, angle:asarray):
@@ -2735,6 +3277,7 @@ class Ravel(Array):
 
   __slots__ = 'func', 'axis'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint):
@@ -2849,6 +3392,7 @@ class Unravel(Array):
 
   __slots__ = 'func', 'axis', 'unravelshape'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint, shape:asshape):
@@ -2921,6 +3465,7 @@ class Mask(Array):
 
   __slots__ = 'func', 'axis', 'mask'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, mask:types.frozenarray, axis:types.strictint):
@@ -3030,11 +3575,19 @@ class Polyval(Array):
      All coefficients with a (combined) degree larger than :math:`d` should be
      zero.  Failing to do so won't raise an :class:`Exception`, but might give
      incorrect results.
+
+  Since the coefficients and points are typically identical for all elements
+  of the same reference, evaluated values are tabulated per combination of
+  coefficients, points and ``ngrad``, retaining up to ``maxtables`` most
+  recently used tables.
   '''
 
   __slots__ = 'points_ndim', 'coeffs', 'points', 'ngrad'
   __cache__ = 'simplified',
 
+  maxtables = 1024
+  _tables = collections.OrderedDict()
+
   @types.apply_annotations
   def __init__(self, coeffs:asarray, points:asarray, ngrad:types.strictint=0):
     if points.ndim != 1:
@@ -3052,11 +3605,22 @@ class Polyval(Array):
 
   def evalf(self, points, coeffs):
     assert points.shape[1] == self.points_ndim
-    points = types.frozenarray(points)
-    coeffs = types.frozenarray(coeffs)
-    for igrad in range(self.ngrad):
-      coeffs = numeric.poly_grad(coeffs, self.points_ndim)
-    return numeric.poly_eval(coeffs, points)
+    points = numpy.asarray(points)
+    coeffs = numpy.asarray(coeffs)
+    key = self.ngrad, points.shape, points.tobytes(), coeffs.shape, coeffs.dtype.char, coeffs.tobytes()
+    try:
+      table = self._tables[key]
+    except KeyError:
+      points = types.frozenarray(points)
+      coeffs = types.frozenarray(coeffs)
+      for igrad in range(self.ngrad):
+        coeffs = numeric.poly_grad(coeffs, self.points_ndim)
+      table = self._tables[key] = numeric.poly_eval(coeffs, points)
+      if len(self._tables) > self.maxtables:
+        self._tables.popitem(last=False)
+    else:
+      self._tables.move_to_end(key)
+    return table
 
   def _derivative(self, var, seen):
     # Derivative to argument `points`.
@@ -3154,6 +3718,7 @@ class Kronecker(Array):
 
   __slots__ = 'func', 'axis', 'length', 'pos'
   __cache__ = 'simplified', 'blocks'
+  _batchargs = 0,
 
   @types.apply_annotations
   def __init__(self, func:asarray, axis:types.strictint, length:asarray, pos:asarray):
@@ -3179,7 +3744,7 @@ class Kronecker(Array):
   def evalf(self, func, length, pos):
     length, = length
     pos, = pos
-    retval = numpy.zeros(func.shape[:self.axis+1] + (length,) + func.shape[self.axis+1:], dtype=func.dtype)
+    retval = _zeros(self, func.shape[:self.axis+1] + (length,) + func.shape[self.axis+1:], dtype=func.dtype)
     retval[(slice(None),)*(self.axis+1)+(pos,)] = func
     return retval
 
@@ -3753,6 +4318,47 @@ class PrunedBasis(Basis):
 _ascending = lambda arg: numpy.greater(numpy.diff(arg), 0).all()
 _normdims = lambda ndim, shapes: tuple(numeric.normdim(ndim,sh) for sh in shapes)
 
+_SHARED, _PERELEM, _STACKED = range(3)
+
+def _unbatch(kind, value, nelems):
+  '''list of per-element values of a batched value, see Evaluable.eval_batched'''
+
+  return [value] * nelems if kind == _SHARED else list(value)
+
+def _stack(values):
+  '''stack per-element arrays, or return None if they do not share a shape'''
+
+  if not all(numeric.isarray(value) for value in values) or len(set(value.shape for value in values)) != 1:
+    return None
+  return numpy.stack(values)
+
+def _evalf_batched(op, args, nelems):
+  '''evaluate element dependent `op` for a batch of elements, see
+  Evaluable.eval_batched'''
+
+  if all(kind == _SHARED or i in op._batchargs for i, (kind, value) in enumerate(args)):
+    stacked = [value if kind == _STACKED else _stack(value) if kind == _PERELEM else None for kind, value in args]
+    if all(kind == _SHARED or array is not None for (kind, value), array in zip(args, stacked)):
+      # The leading axis of every element should broadcast to npoints, such
+      # that all batched arrays can be flattened to nelems*npoints.
+      lengths = {array.shape[1] for array in stacked if array is not None}
+      lengths.update(len(value) for i, (kind, value) in enumerate(args) if kind == _SHARED and i in op._batchargs and numeric.isarray(value))
+      npoints = builtins.max(lengths)
+      if lengths <= {1, npoints}:
+        flatargs = []
+        for i, ((kind, value), array) in enumerate(zip(args, stacked)):
+          if array is not None:
+            if array.shape[1] != npoints:
+              array = numpy.repeat(array, npoints, axis=1)
+            value = array.reshape((nelems*npoints,)+array.shape[2:])
+          elif i in op._batchargs and numeric.isarray(value) and len(value) == npoints > 1:
+            value = numpy.tile(value, (nelems,)+(1,)*(value.ndim-1))
+          flatargs.append(value)
+        retval = op.evalf(*flatargs)
+        if numeric.isarray(retval) and retval.ndim and len(retval) == nelems*npoints:
+          return _STACKED, numpy.asarray(retval).reshape((nelems, npoints)+retval.shape[1:])
+  return _PERELEM, [op.evalf(*elemargs) for elemargs in zip(*[_unbatch(kind, value, nelems) for kind, value in args])]
+
 def _jointdtype(*dtypes):
   'determine joint dtype'
 
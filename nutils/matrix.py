@@ -81,6 +81,9 @@ class Backend(metaclass=abc.ABCMeta):
 class Matrix(metaclass=types.CacheMeta):
   'matrix base class'
 
+  _aggregates = ()
+  _symmetric = None
+
   def __init__(self, shape):
     assert len(shape) == 2
     self.shape = shape
@@ -163,7 +166,13 @@ class Matrix(metaclass=types.CacheMeta):
     solver : :class:`str`
         Name of the solver algorithm. The set of available solvers depends on
         the type of the matrix (i.e. the active backend), although all matrices
-        should implement at least the 'direct' solver.
+        should implement at least the 'direct' solver. The direct solvers of
+        the SciPy and MKL backends detect symmetric matrices, for which they
+        factorize only the upper triangle or preserve symmetry; the detection
+        can be overruled by passing a boolean ``symmetric`` argument. These
+        backends additionally implement the 'mixed' solver, which factorizes a
+        single precision copy of the matrix and refines the solution against
+        the double precision residual.
     **kwargs :
         All remaining arguments are passed on to the selected solver method.
 
@@ -200,6 +209,8 @@ class Matrix(metaclass=types.CacheMeta):
     n = I.sum()
     if J.sum() != n:
       raise MatrixError('constrained matrix is not square: {}x{}'.format(I.sum(), J.sum()))
+    if isinstance(solverargs.get('precon'), FieldSplit): # fields refer to all dofs
+      solverargs['precon'] = solverargs['precon'].restrict(J)
     b = (rhs - self @ x)[J]
     bnorm = numpy.linalg.norm(b)
     atol = max(atol, rtol * bnorm)
@@ -272,6 +283,60 @@ class Matrix(metaclass=types.CacheMeta):
 
     raise NotImplementedError('cannot export {} to {!r}'.format(self.__class__.__name__, form))
 
+  def update(self, data):
+    '''Replace the values of the matrix in place.
+
+    The sparsity pattern of the matrix remains unchanged, which allows
+    backends to retain the symbolic analysis of a prior factorization, such as
+    the fill reducing ordering, and redo only the numerical factorization in a
+    subsequent solve.
+
+    Args
+    ----
+    data : :class:`Matrix` or :class:`float` array
+        Matrix of equal shape and sparsity pattern, or the array of new values
+        in the order of ``export('csr')``.
+    '''
+
+    values, indices, indptr = self.export('csr')
+    if isinstance(data, Matrix):
+      if data.shape != self.shape:
+        raise MatrixError('non-matching shapes')
+      data, newindices, newindptr = data.export('csr')
+      if not numpy.array_equal(newindptr, indptr) or not numpy.array_equal(newindices, indices):
+        raise MatrixError('non-matching sparsity patterns')
+    data = numpy.asarray(data)
+    if data.shape != values.shape:
+      raise MatrixError('expected {} values, got an array of shape {}'.format(len(values), data.shape))
+    self._update(data, indices, indptr)
+    self._symmetric = None
+
+  def _update(self, data, indices, indptr):
+    raise NotImplementedError('{} does not support updates'.format(type(self).__name__))
+
+  def _issymmetric(self):
+    '''Return whether the matrix is symmetric up to rounding errors, retaining
+    the outcome until the values are updated.'''
+
+    if self._symmetric is None:
+      if self.shape[0] != self.shape[1]:
+        self._symmetric = False
+      else:
+        A = _CSR(*self.export('csr'), self.shape[1])
+        A = _CSR.fromcoo(A.data, A.rows, A.indices, A.shape) # sort indices and sum duplicates
+        AT = A.T
+        tol = 16 * numpy.finfo(float).eps * abs(A.data).max(initial=0)
+        self._symmetric = numpy.array_equal(A.indptr, AT.indptr) and numpy.array_equal(A.indices, AT.indices) and bool((abs(A.data - AT.data) <= tol).all())
+    return self._symmetric
+
+  def _amg(self):
+    '''Return an algebraic multigrid preconditioner, reusing the aggregates of
+    a prior setup with the same sparsity pattern.'''
+
+    amg = AMG(*self.export('csr'), aggregates=self._aggregates)
+    self._aggregates = amg.aggregates
+    return amg
+
   def diagonal(self):
     nrows, ncols = self.shape
     if nrows != ncols:
@@ -377,14 +442,255 @@ class NumpyMatrix(Matrix):
   def rowsupp(self, tol=0):
     return numpy.greater(abs(self.core), tol).any(axis=1)
 
+  def update(self, data):
+    if isinstance(data, Matrix): # dense matrices have no sparsity pattern to preserve
+      self.core = numpy.array(self.convert(data).core)
+      self._symmetric = None
+    else:
+      super().update(data)
+
+  def _update(self, data, indices, indptr):
+    core = numpy.zeros(self.shape, dtype=numpy.result_type(self.core, data))
+    core[numpy.arange(self.shape[0]).repeat(numpy.diff(indptr)), indices] = data
+    self.core = core
+
   @refine_to_tolerance
-  def solve_direct(self, rhs):
+  def solve_direct(self, rhs, symmetric=None): # symmetry is not exploited
     return numpy.linalg.solve(self.core, rhs)
 
   def submatrix(self, rows, cols):
     return NumpyMatrix(self.core[numpy.ix_(rows, cols)])
 
 
+## NUMPY CSR BACKEND
+
+class CSR(Backend):
+  '''matrix backend based on compressed sparse row storage in numpy arrays'''
+
+  def __bool__(self):
+    return True
+
+  def assemble(self, data, index, shape):
+    return CSRMatrix(data, index[1], index[0].searchsorted(numpy.arange(shape[0]+1)), shape[1])
+
+class CSRMatrix(Matrix):
+  '''matrix based on compressed sparse row data, with iterative solvers
+  implemented in numpy'''
+
+  def __init__(self, data, indices, indptr, ncols):
+    assert len(data) == len(indices) == indptr[-1]
+    self.data = numpy.asarray(data, dtype=float)
+    self.indices = numpy.asarray(indices)
+    self.indptr = numpy.asarray(indptr)
+    self._precons = {}
+    super().__init__((len(indptr)-1, ncols))
+
+  @classmethod
+  def _fromcsr(cls, csr):
+    return cls(csr.data, csr.indices, csr.indptr, csr.shape[1])
+
+  @property
+  def _csr(self):
+    return _CSR(self.data, self.indices, self.indptr, self.shape[1])
+
+  def convert(self, mat):
+    if not isinstance(mat, Matrix):
+      raise TypeError('cannot convert {} to Matrix'.format(type(mat).__name__))
+    if self.shape != mat.shape:
+      raise MatrixError('non-matching shapes')
+    if isinstance(mat, CSRMatrix):
+      return mat
+    data, indices, indptr = mat.export('csr')
+    return CSRMatrix(data, indices, indptr, self.shape[1])
+
+  def __add__(self, other):
+    other = self.convert(other)
+    A = self._csr
+    B = other._csr
+    return self._fromcsr(_CSR.fromcoo(numpy.hstack([A.data, B.data]), numpy.hstack([A.rows, B.rows]), numpy.hstack([A.indices, B.indices]), self.shape))
+
+  def __mul__(self, other):
+    if not numeric.isnumber(other):
+      raise TypeError
+    return CSRMatrix(self.data * other, self.indices, self.indptr, self.shape[1])
+
+  def __matmul__(self, other):
+    if not isinstance(other, numpy.ndarray):
+      raise TypeError
+    if other.shape[0] != self.shape[1]:
+      raise MatrixError
+    products = numpy.einsum('i,i...->i...', self.data, other[self.indices])
+    retval = numpy.zeros((self.shape[0],)+other.shape[1:], dtype=products.dtype)
+    nonempty = self.indptr[:-1] < self.indptr[1:]
+    if nonempty.any():
+      retval[nonempty] = numpy.add.reduceat(products, self.indptr[:-1][nonempty], axis=0)
+    return retval
+
+  def __neg__(self):
+    return CSRMatrix(-self.data, self.indices, self.indptr, self.shape[1])
+
+  @property
+  def T(self):
+    return self._fromcsr(self._csr.T)
+
+  def export(self, form):
+    if form == 'dense':
+      return self._csr.toarray()
+    if form == 'csr':
+      return self.data, self.indices, self.indptr
+    if form == 'coo':
+      return self.data, (self._csr.rows, self.indices)
+    raise NotImplementedError('cannot export CSRMatrix to {!r}'.format(form))
+
+  def _update(self, data, indices, indptr):
+    self.data = numpy.array(data, dtype=float)
+    self._precons = {}
+
+  def submatrix(self, rows, cols):
+    rows = numeric.asboolean(rows, self.shape[0])
+    cols = numeric.asboolean(cols, self.shape[1])
+    if rows.all() and cols.all():
+      return self
+    keep = rows.repeat(numpy.diff(self.indptr)) & cols[self.indices]
+    indptr = numpy.hstack([0, numpy.add.reduceat(keep, self.indptr[:-1])[rows] if len(keep) else numpy.zeros(rows.sum(), dtype=int)]).cumsum()
+    return CSRMatrix(self.data[keep], (cols.cumsum()-1)[self.indices[keep]], indptr, cols.sum())
+
+  @refine_to_tolerance
+  def solve_direct(self, rhs, symmetric=None): # dense fallback
+    log.debug('solving system as dense matrix')
+    return numpy.linalg.solve(self.export('dense'), rhs)
+
+  def getprecon(self, precon):
+    if precon is None:
+      return lambda res: res
+    if callable(precon) and not isinstance(precon, FieldSplit):
+      return precon
+    if precon in self._precons:
+      log.debug('reusing existing preconditioner')
+      return self._precons[precon]
+    if precon == 'diag':
+      diag = self.diagonal()
+      if not diag.all():
+        raise MatrixError("building 'diag' preconditioner: diagonal has zero entries")
+      M = numpy.reciprocal(diag).__mul__
+    elif precon == 'amg':
+      M = self._amg()
+    elif isinstance(precon, FieldSplit):
+      M = precon.build(self)
+    else:
+      raise MatrixError('invalid preconditioner {!r}'.format(precon))
+    self._precons[precon] = M
+    return M
+
+  def solve_cg(self, rhs, atol, precon=None, maxiter=None):
+    M = self.getprecon(precon)
+    lhs = numpy.zeros_like(rhs, dtype=float)
+    res = numpy.array(rhs, dtype=float)
+    z = M(res)
+    p = z.copy()
+    rz = res @ z
+    with log.context('cg {:.0f}%', 0) as reformat:
+      for i in itertools.count() if maxiter is None else range(maxiter):
+        resnorm = numpy.linalg.norm(res)
+        _progress(reformat, resnorm, rhs, atol)
+        if resnorm <= atol:
+          break
+        Ap = self @ p
+        alpha = rz / (p @ Ap)
+        lhs += alpha * p
+        res -= alpha * Ap
+        z = M(res)
+        rz, rzold = res @ z, rz
+        p *= rz / rzold
+        p += z
+    log.debug('performed {} cg iterations'.format(i))
+    return lhs
+
+  def solve_bicgstab(self, rhs, atol, precon=None, maxiter=None):
+    M = self.getprecon(precon)
+    lhs = numpy.zeros_like(rhs, dtype=float)
+    res = numpy.array(rhs, dtype=float)
+    res0 = res.copy()
+    rho = alpha = omega = 1.
+    v = p = numpy.zeros_like(lhs)
+    with log.context('bicgstab {:.0f}%', 0) as reformat:
+      for i in itertools.count() if maxiter is None else range(maxiter):
+        resnorm = numpy.linalg.norm(res)
+        _progress(reformat, resnorm, rhs, atol)
+        if resnorm <= atol:
+          break
+        rho, rhoold = res0 @ res, rho
+        if rho == 0 or omega == 0:
+          raise MatrixError('bicgstab breakdown')
+        p = res + (rho / rhoold) * (alpha / omega) * (p - omega * v)
+        phat = M(p)
+        v = self @ phat
+        alpha = rho / (res0 @ v)
+        s = res - alpha * v
+        shat = M(s)
+        t = self @ shat
+        omega = (t @ s) / (t @ t) if t.any() else 0.
+        lhs += alpha * phat + omega * shat
+        res = s - omega * t
+    log.debug('performed {} bicgstab iterations'.format(i))
+    return lhs
+
+  def solve_gmres(self, rhs, atol, precon=None, restart=50, maxiter=None):
+    M = self.getprecon(precon)
+    n = len(rhs)
+    lhs = numpy.zeros_like(rhs, dtype=float)
+    res = numpy.array(rhs, dtype=float)
+    resnorm = numpy.linalg.norm(res)
+    niter = 0
+    with log.context('gmres {:.0f}%', 0) as reformat:
+      while resnorm > atol and (maxiter is None or niter < maxiter):
+        # restarted, right preconditioned gmres with givens rotations
+        V = numpy.empty((restart+1, n))
+        Z = numpy.empty((restart, n))
+        H = numpy.zeros((restart+1, restart))
+        cs = numpy.empty(restart)
+        sn = numpy.empty(restart)
+        g = numpy.zeros(restart+1)
+        g[0] = resnorm
+        V[0] = res / resnorm
+        for j in range(restart):
+          niter += 1
+          Z[j] = M(V[j])
+          w = self @ Z[j]
+          for k in range(j+1): # modified gram-schmidt
+            H[k,j] = w @ V[k]
+            w -= H[k,j] * V[k]
+          H[j+1,j] = numpy.linalg.norm(w)
+          if H[j+1,j]:
+            V[j+1] = w / H[j+1,j]
+          for k in range(j):
+            H[k,j], H[k+1,j] = cs[k] * H[k,j] + sn[k] * H[k+1,j], cs[k] * H[k+1,j] - sn[k] * H[k,j]
+          r = numpy.hypot(H[j,j], H[j+1,j])
+          cs[j], sn[j] = H[j,j] / r, H[j+1,j] / r
+          H[j,j], H[j+1,j] = r, 0.
+          g[j+1] = -sn[j] * g[j]
+          g[j] *= cs[j]
+          _progress(reformat, abs(g[j+1]), rhs, atol)
+          if abs(g[j+1]) <= atol or not H[j+1,j] and not r or maxiter is not None and niter >= maxiter:
+            break
+        y = numpy.linalg.solve(numpy.triu(H[:j+1,:j+1]), g[:j+1])
+        lhs += y @ Z[:j+1]
+        res = rhs - self @ lhs
+        newresnorm = numpy.linalg.norm(res)
+        if newresnorm >= resnorm: # stagnation
+          break
+        resnorm = newresnorm
+    log.debug('performed {} gmres iterations'.format(niter))
+    return lhs
+
+def _progress(reformat, resnorm, rhs, atol):
+  '''Update the logged progress of an iterative solver, measured on a log
+  scale from the right hand side norm towards ``atol``.'''
+
+  rhsnorm = numpy.linalg.norm(rhs)
+  if atol > 0 and rhsnorm > atol:
+    reformat(100 * numpy.log10(rhsnorm / max(atol, min(resnorm, rhsnorm))) / numpy.log10(rhsnorm / atol))
+
 ## SCIPY BACKEND
 
 class Scipy(Backend):
@@ -408,9 +714,13 @@ class Scipy(Backend):
 class ScipyMatrix(Matrix):
   '''matrix based on any of scipy's sparse matrices'''
 
+  _colperm = None
+  _symperm = None
+
   def __init__(self, core, scipy):
     self.core = core
     self.scipy = scipy
+    self._factors = {}
     super().__init__(core.shape)
 
   def convert(self, mat):
@@ -458,16 +768,85 @@ class ScipyMatrix(Matrix):
   def T(self):
     return ScipyMatrix(self.core.transpose(), scipy=self.scipy)
 
+  def _update(self, data, indices, indptr):
+    self.core = self.scipy.sparse.csr_matrix((numpy.array(data, dtype=float), indices, indptr), self.shape)
+    self._factors = {}
+
+  def _factorize(self, name):
+    '''Return the solve method of the 'splu' factorization, optionally suffixed
+    by ':single' and/or ':symmetric', the 'spilu' factorization, the 'amg'
+    multigrid hierarchy, or a field split preconditioner, which is retained
+    for subsequent solves until the matrix values are updated.'''
+
+    try:
+      solve = self._factors[name]
+    except KeyError:
+      try:
+        if isinstance(name, str) and name.split(':')[0] == 'splu':
+          options = name.split(':')[1:]
+          solve = self._splu(symmetric='symmetric' in options, single='single' in options)
+        elif name == 'spilu':
+          solve = self.scipy.sparse.linalg.spilu(self.core.tocsc(), drop_tol=1e-5, fill_factor=None, drop_rule=None, permc_spec=None, diag_pivot_thresh=None, relax=None, panel_size=None, options=None).solve
+        elif name == 'amg':
+          solve = self._amg()
+        else:
+          solve = name.build(self)
+      except RuntimeError as e:
+        raise MatrixError(e) from e
+      self._factors[name] = solve
+    else:
+      log.debug('reusing existing {}'.format(name if isinstance(name, str) else 'field split'))
+    return solve
+
+  def _splu(self, symmetric=False, single=False):
+    '''Return the solve method of the LU factorization, which reuses the
+    fill reducing ordering of a prior factorization. Symmetric matrices are
+    factorized in SuperLU's symmetric mode, which orders rows and columns alike
+    and favours diagonal pivots, thus preserving symmetry and reducing fill.
+    If ``single`` is true the factorization is formed in single precision,
+    while the returned solution is in double precision.'''
+
+    splu = self.scipy.sparse.linalg.splu
+    if symmetric:
+      splu = functools.partial(splu, diag_pivot_thresh=.001, options=dict(SymmetricMode=True))
+    csc = self.core.tocsc().astype(numpy.float32 if single else numpy.float64)
+    perm = self._symperm if symmetric else self._colperm
+    if perm is None:
+      lu = splu(csc, permc_spec='MMD_AT_PLUS_A' if symmetric else 'COLAMD')
+      if symmetric:
+        self._symperm = numpy.argsort(lu.perm_c)
+      else:
+        self._colperm = numpy.argsort(lu.perm_c)
+      if not single:
+        return lu.solve
+      perm = slice(None)
+    else:
+      log.debug('reusing existing {}ordering'.format('symmetric ' if symmetric else 'column '))
+      lu = splu(csc[perm][:,perm] if symmetric else csc[:,perm], permc_spec='NATURAL')
+    def solve(rhs):
+      lhs = numpy.empty_like(rhs, dtype=float)
+      lhs[perm] = lu.solve(numpy.asarray(rhs[perm] if symmetric else rhs, dtype=csc.dtype))
+      return lhs
+    return solve
+
   @refine_to_tolerance
-  def solve_direct(self, rhs):
-    return self.scipy.sparse.linalg.spsolve(self.core, rhs)
+  def solve_direct(self, rhs, symmetric=None):
+    if symmetric is None:
+      symmetric = self._issymmetric()
+    return self._factorize('splu:symmetric' if symmetric else 'splu')(rhs)
+
+  @refine_to_tolerance
+  def solve_mixed(self, rhs, symmetric=None):
+    if symmetric is None:
+      symmetric = self._issymmetric()
+    return self._factorize('splu:single:symmetric' if symmetric else 'splu:single')(rhs)
 
   def solve_scipy(self, rhs, solver, atol, callback=None, precon=None, **solverargs):
     rhsnorm = numpy.linalg.norm(rhs)
     solverfun = getattr(self.scipy.sparse.linalg, solver)
     myrhs = rhs / rhsnorm # normalize right hand side vector for best control over scipy's stopping criterion
     mytol = atol / rhsnorm
-    M = self.getprecon(precon) if isinstance(precon, str) else precon(self.core) if callable(precon) else precon
+    M = self.getprecon(precon) if isinstance(precon, (str, FieldSplit)) else precon(self.core) if callable(precon) else precon
     with log.context(solver + ' {:.0f}%', 0) as reformat:
       def mycallback(arg):
         # some solvers provide the residual, others the left hand side vector
@@ -489,19 +868,12 @@ class ScipyMatrix(Matrix):
   solve_minres   = lambda self, rhs, **kwargs: self.solve_scipy(rhs, 'minres',   **kwargs)
 
   def getprecon(self, name):
-    name = name.lower()
+    if not isinstance(name, FieldSplit):
+      name = name.lower()
     assert self.shape[0] == self.shape[1], 'constrained matrix must be square'
-    log.info('building {} preconditioner'.format(name))
-    if name == 'splu':
-      try:
-        precon = self.scipy.sparse.linalg.splu(self.core.tocsc()).solve
-      except RuntimeError as e:
-        raise MatrixError(e) from e
-    elif name == 'spilu':
-      try:
-        precon = self.scipy.sparse.linalg.spilu(self.core.tocsc(), drop_tol=1e-5, fill_factor=None, drop_rule=None, permc_spec=None, diag_pivot_thresh=None, relax=None, panel_size=None, options=None).solve
-      except RuntimeError as e:
-        raise MatrixError(e) from e
+    log.info('building {} preconditioner'.format(name if isinstance(name, str) else 'field split'))
+    if isinstance(name, FieldSplit) or name in ('splu', 'spilu', 'amg'):
+      precon = self._factorize('splu:symmetric' if name == 'splu' and self._issymmetric() else name)
     elif name == 'diag':
       diag = self.core.diagonal()
       if not diag.all():
@@ -512,6 +884,10 @@ class ScipyMatrix(Matrix):
     return self.scipy.sparse.linalg.LinearOperator(self.shape, precon, dtype=float)
 
   def submatrix(self, rows, cols):
+    rows = numeric.asboolean(rows, self.shape[0])
+    cols = numeric.asboolean(cols, self.shape[1])
+    if rows.all() and cols.all(): # retain factorizations
+      return self
     return ScipyMatrix(self.core[rows,:][:,cols], scipy=self.scipy)
 
   def diagonal(self):
@@ -522,7 +898,9 @@ class ScipyMatrix(Matrix):
 
 c_int = types.c_array[numpy.int32]
 c_long = types.c_array[numpy.int64]
+c_float = types.c_array[numpy.float32]
 c_double = types.c_array[numpy.float64]
+c_real = lambda array: (c_float if array.dtype == numpy.float32 else c_double)(array) # single or double precision
 
 class MKL(Backend):
   '''matrix backend based on Intel's Math Kernel Library'''
@@ -584,7 +962,7 @@ class Pardiso:
     self.pt = numpy.zeros(64, numpy.int64) # handle to data structure
 
   @types.apply_annotations
-  def __call__(self, *, phase:c_int, iparm:c_int, maxfct:c_int=1, mnum:c_int=1, mtype:c_int=0, n:c_int=0, a:c_double=None, ia:c_int=None, ja:c_int=None, perm:c_int=None, nrhs:c_int=0, msglvl:c_int=0, b:c_double=None, x:c_double=None):
+  def __call__(self, *, phase:c_int, iparm:c_int, maxfct:c_int=1, mnum:c_int=1, mtype:c_int=0, n:c_int=0, a:c_real=None, ia:c_int=None, ja:c_int=None, perm:c_int=None, nrhs:c_int=0, msglvl:c_int=0, b:c_real=None, x:c_real=None):
     error = ctypes.c_int32(1)
     self._pardiso(self.pt.ctypes, maxfct, mnum, mtype, phase, n, a, ia, ja, perm, nrhs, iparm, msglvl, b, x, ctypes.byref(error))
     if error.value:
@@ -599,6 +977,7 @@ class MKLMatrix(Matrix):
   '''matrix implementation based on sorted coo data'''
 
   _factors = False
+  _refactor = False
 
   def __init__(self, data, rowptr, colidx, ncols, libmkl):
     assert len(data) == len(colidx) == rowptr[-1]-1
@@ -606,6 +985,7 @@ class MKLMatrix(Matrix):
     self.rowptr = numpy.ascontiguousarray(rowptr, dtype=numpy.int32)
     self.colidx = numpy.ascontiguousarray(colidx, dtype=numpy.int32)
     self.libmkl = libmkl
+    self._precons = {}
     super().__init__((len(rowptr)-1, ncols))
 
   def convert(self, mat):
@@ -709,30 +1089,95 @@ class MKLMatrix(Matrix):
       return self.data, (numpy.arange(self.shape[0]).repeat(self.rowptr[1:]-self.rowptr[:-1]), self.colidx-1)
     raise NotImplementedError('cannot export MKLMatrix to {!r}'.format(form))
 
+  def _update(self, data, indices, indptr):
+    self.data = numpy.array(data, dtype=numpy.float64)
+    self._refactor = bool(self._factors)
+    self._precons = {}
+
   @refine_to_tolerance
-  def solve_direct(self, rhs):
-    log.debug('solving system using MKL Pardiso')
-    if self._factors:
+  def solve_direct(self, rhs, symmetric=None):
+    return self._solve(rhs, symmetric, single=False)
+
+  @refine_to_tolerance
+  def solve_mixed(self, rhs, symmetric=None):
+    return self._solve(rhs, symmetric, single=True)
+
+  def _solve(self, rhs, symmetric, single):
+    log.debug('solving system using MKL Pardiso in {} precision'.format('single' if single else 'double'))
+    dtype = numpy.float32 if single else numpy.float64
+    if symmetric is None:
+      symmetric = self._issymmetric()
+    if symmetric and not self._hasdiagonal():
+      log.debug('solving symmetric system as nonsymmetric because of missing diagonal entries')
+      symmetric = False
+    factors = self._factors
+    if factors and ((factors[2] != 11) != symmetric or factors[1][27] != single):
+      log.debug('discarding existing factorization')
+      factors = False
+    if factors and self._refactor:
+      log.debug('reusing existing analysis')
+      phase = 23 # numerical factorization, solve, iterative refinement
+    elif factors:
       log.debug('reusing existing factorization')
-      pardiso, iparm, mtype = self._factors
       phase = 33 # solve, iterative refinement
-    else:
-      pardiso = Pardiso(self.libmkl)
-      iparm = numpy.zeros(64, dtype=numpy.int32) # https://software.intel.com/en-us/mkl-developer-reference-c-pardiso-iparm-parameter
-      iparm[0] = 1 # supply all values in components iparm[1:64]
-      iparm[1] = 2 # fill-in reducing ordering for the input matrix: nested dissection algorithm from the METIS package
+    self._refactor = False
+    rhsflat = numpy.ascontiguousarray(rhs.reshape(rhs.shape[0], -1).T, dtype=dtype)
+    lhsflat = numpy.empty((rhsflat.shape[0], self.shape[1]), dtype=dtype)
+    mtypes = [2, -2] if symmetric else [11] # real and symmetric positive definite, symmetric indefinite, or nonsymmetric
+    while True:
+      if not factors:
+        factors = self._pardiso(mtypes.pop(0), single)
+        phase = 13 # analysis, numerical factorization, solve, iterative refinement
+      pardiso, iparm, mtype, upper = factors
+      try:
+        if upper is None:
+          pardiso(phase=phase, mtype=mtype, iparm=iparm, n=self.shape[0], nrhs=rhsflat.shape[0], b=rhsflat, x=lhsflat, a=self.data.astype(dtype, copy=False), ia=self.rowptr, ja=self.colidx)
+        else:
+          keep, rowptr, colidx = upper
+          pardiso(phase=phase, mtype=mtype, iparm=iparm, n=self.shape[0], nrhs=rhsflat.shape[0], b=rhsflat, x=lhsflat, a=self.data[keep].astype(dtype, copy=False), ia=rowptr, ja=colidx)
+      except MatrixError:
+        if mtype != 2 or phase == 33:
+          self._factors = False
+          raise
+        log.debug('matrix is not positive definite')
+        factors = False
+        mtypes = [-2]
+      else:
+        break
+    self._factors = factors
+    log.debug('solver returned after {} refinement steps; peak memory use {:,d}k'.format(iparm[6], max(iparm[14], iparm[15]+iparm[16])))
+    return lhsflat.T.reshape(lhsflat.shape[1:] + rhs.shape[1:]).astype(numpy.float64, copy=False)
+
+  def _hasdiagonal(self):
+    '''Return whether all diagonal entries are part of the sparsity pattern.'''
+
+    rows = numpy.arange(self.shape[0]).repeat(numpy.diff(self.rowptr))
+    return numpy.bincount(rows[rows == self.colidx-1], minlength=self.shape[0]).all()
+
+  def _pardiso(self, mtype, single):
+    '''Return a new Pardiso handle, its parameters, the matrix type, and, for
+    symmetric matrix types, the selection and compressed row structure of
+    the upper triangle.'''
+
+    pardiso = Pardiso(self.libmkl)
+    iparm = numpy.zeros(64, dtype=numpy.int32) # https://software.intel.com/en-us/mkl-developer-reference-c-pardiso-iparm-parameter
+    iparm[0] = 1 # supply all values in components iparm[1:64]
+    iparm[1] = 2 # fill-in reducing ordering for the input matrix: nested dissection algorithm from the METIS package
+    iparm[27] = single # single or double precision
+    iparm[34] = 0 # one-based indexing
+    if mtype == 11:
       iparm[9] = 13 # pivoting perturbation threshold 1e-13 (default for nonsymmetric)
       iparm[10] = 1 # enable scaling vectors (default for nonsymmetric)
       iparm[12] = 1 # enable improved accuracy using (non-) symmetric weighted matching (default for nonsymmetric)
-      iparm[34] = 0 # one-based indexing
-      mtype = 11 # real and nonsymmetric
-      phase = 13 # analysis, numerical factorization, solve, iterative refinement
-      self._factors = pardiso, iparm, mtype
-    rhsflat = numpy.ascontiguousarray(rhs.reshape(rhs.shape[0], -1).T, dtype=numpy.float64)
-    lhsflat = numpy.empty((rhsflat.shape[0], self.shape[1]), dtype=numpy.float64)
-    pardiso(phase=phase, mtype=mtype, iparm=iparm, n=self.shape[0], nrhs=rhsflat.shape[0], b=rhsflat, x=lhsflat, a=self.data, ia=self.rowptr, ja=self.colidx)
-    log.debug('solver returned after {} refinement steps; peak memory use {:,d}k'.format(iparm[6], max(iparm[14], iparm[15]+iparm[16])))
-    return lhsflat.T.reshape(lhsflat.shape[1:] + rhs.shape[1:])
+      return pardiso, iparm, mtype, None
+    iparm[9] = 8 # pivoting perturbation threshold 1e-8 (default for symmetric)
+    if mtype == -2:
+      iparm[10] = 1 # enable scaling vectors (recommended for symmetric indefinite)
+      iparm[12] = 1 # enable symmetric weighted matching (recommended for symmetric indefinite)
+    rows = numpy.arange(self.shape[0]).repeat(numpy.diff(self.rowptr))
+    keep = self.colidx-1 >= rows # upper triangle, including the diagonal
+    rowptr = numpy.cumsum(numpy.hstack([1, numpy.bincount(rows[keep], minlength=self.shape[0])]), dtype=numpy.int32)
+    return pardiso, iparm, mtype, (keep, rowptr, numpy.ascontiguousarray(self.colidx[keep]))
 
   def solve_fgmres(self, rhs, atol, maxiter=0, restart=150, precon=None, ztol=1e-12):
     rci = ctypes.c_int32(0)
@@ -761,6 +1206,12 @@ class MKLMatrix(Matrix):
         if not diag.all():
           raise MatrixError("building 'diag' preconditioner: diagonal has zero entries")
         precon = numpy.reciprocal(diag).__mul__
+      elif precon == 'amg' or isinstance(precon, FieldSplit):
+        if precon in self._precons:
+          log.debug('reusing existing preconditioner')
+          precon = self._precons[precon]
+        else:
+          precon = self._precons[precon] = self._amg() if precon == 'amg' else precon.build(self)
       elif not callable(precon):
         raise MatrixError('invalid preconditioner {!r}'.format(precon))
     ipar[11] = 0 # do not perform the automatic test for zero norm of the currently generated vector: dpar[6] <= dpar[7]
@@ -799,6 +1250,267 @@ class MKLMatrix(Matrix):
     log.debug('performed {} fgmres iterations, {} restarts'.format(ipar[3], ipar[3]//ipar[14]))
     return b
 
+## ALGEBRAIC MULTIGRID
+
+class _CSR:
+  '''minimal compressed sparse row matrix for multigrid setup and cycling'''
+
+  def __init__(self, data, indices, indptr, ncols):
+    self.data = data
+    self.indices = indices
+    self.indptr = indptr
+    self.shape = len(indptr)-1, ncols
+    self.rows = numpy.arange(self.shape[0]).repeat(numpy.diff(indptr))
+
+  @classmethod
+  def fromcoo(cls, data, rows, cols, shape):
+    '''Create matrix from coordinate data, summing duplicate entries.'''
+
+    keys = rows.astype(numpy.int64) * shape[1] + cols
+    order = numpy.argsort(keys, kind='stable')
+    keys = keys[order]
+    n, = numpy.hstack([True, keys[1:] != keys[:-1]]).nonzero() if len(keys) else (numpy.empty(0, dtype=int),)
+    data = numpy.add.reduceat(data[order], n) if len(n) else numpy.empty(0)
+    rows, cols = divmod(keys[n], shape[1])
+    return cls(data, cols, rows.searchsorted(numpy.arange(shape[0]+1)), shape[1])
+
+  def __matmul__(self, other):
+    if not isinstance(other, _CSR):
+      return numpy.bincount(self.rows, self.data * other[self.indices], minlength=self.shape[0])
+    counts = numpy.diff(other.indptr)[self.indices]
+    index = numpy.arange(counts.sum()) + (other.indptr[self.indices] - counts.cumsum() + counts).repeat(counts)
+    return _CSR.fromcoo(self.data.repeat(counts) * other.data[index], self.rows.repeat(counts), other.indices[index], (self.shape[0], other.shape[1]))
+
+  @property
+  def T(self):
+    return _CSR.fromcoo(self.data, self.indices, self.rows, self.shape[::-1])
+
+  def diagonal(self):
+    isdiag = self.rows == self.indices
+    return numpy.bincount(self.rows[isdiag], self.data[isdiag], minlength=self.shape[0])
+
+  def toarray(self):
+    array = numpy.zeros(self.shape)
+    numpy.add.at(array, (self.rows, self.indices), self.data)
+    return array
+
+  def rowmax(self, values):
+    '''Maximum of ``values`` over every row's column indices and the row index
+    itself.'''
+
+    retval = numpy.array(values)
+    nonempty = self.indptr[:-1] < self.indptr[1:]
+    if nonempty.any():
+      retval[nonempty] = numpy.maximum(retval[nonempty], numpy.maximum.reduceat(values[self.indices], self.indptr[:-1][nonempty]))
+    return retval
+
+class AMG:
+  '''Smoothed aggregation algebraic multigrid preconditioner.
+
+  The hierarchy is formed from square matrix data in compressed sparse row
+  form, such as returned by ``export('csr')``. Every level groups the nodes of
+  the strength-of-connection graph into aggregates around a maximal set of
+  nodes that are at least three connections apart, forms a piecewise constant
+  tentative prolongator, which represents the near null space of scalar
+  elliptic operators, and smooths it with a damped Jacobi iteration. The
+  coarse matrices follow from the Galerkin product. Calling the object
+  performs a symmetric V-cycle with damped Jacobi smoothing, which makes it
+  suitable as a preconditioner for the conjugate gradient method.
+
+  Args
+  ----
+  data, indices, indptr : :class:`numpy.ndarray`
+      Values, column indices and row pointers of the matrix.
+  aggregates : :class:`tuple` of integer arrays, optional
+      Aggregates of a prior setup for the same sparsity pattern, available as
+      the ``aggregates`` attribute, which are reused instead of formed anew.
+  theta : :class:`float`
+      Strength of connection threshold.
+  maxcoarse : :class:`int`
+      Maximum size of the coarsest level, which is solved directly.
+  maxlevels : :class:`int`
+      Maximum number of levels.
+  '''
+
+  def __init__(self, data, indices, indptr, *, aggregates=(), theta=.08, maxcoarse=500, maxlevels=20):
+    A = _CSR(numpy.asarray(data, dtype=float), numpy.asarray(indices), numpy.asarray(indptr), len(indptr)-1)
+    self.levels = []
+    self.aggregates = ()
+    while A.shape[0] > maxcoarse and len(self.levels) < maxlevels-1:
+      diag = A.diagonal()
+      if not diag.all():
+        raise MatrixError("building 'amg' preconditioner: diagonal has zero entries")
+      dinv = numpy.reciprocal(diag)
+      iagg = aggregates[len(self.levels)] if len(self.levels) < len(aggregates) else self._aggregate(A, abs(diag), theta)
+      nagg = iagg.max() + 1
+      if nagg == A.shape[0]:
+        break
+      T = _CSR(1 / numpy.sqrt(numpy.bincount(iagg)[iagg]), iagg, numpy.arange(A.shape[0]+1), nagg)
+      wdinv = 4 / (3 * self._spectralradius(A, dinv)) * dinv
+      smoother = _CSR.fromcoo(numpy.hstack([numpy.ones(A.shape[0]), -wdinv[A.rows] * A.data]), numpy.hstack([numpy.arange(A.shape[0]), A.rows]), numpy.hstack([numpy.arange(A.shape[0]), A.indices]), A.shape)
+      P = smoother @ T
+      R = P.T
+      self.levels.append((A, wdinv, P, R))
+      self.aggregates += iagg,
+      A = R @ (A @ P)
+    log.debug('amg hierarchy of {} levels, sizes {}'.format(len(self.levels)+1, ', '.join(str(level[0].shape[0]) for level in self.levels + [(A,)])))
+    self.coarse = numpy.linalg.pinv(A.toarray())
+
+  @staticmethod
+  def _aggregate(A, absdiag, theta):
+    '''Return the aggregate index of every node.'''
+
+    strong = (A.rows != A.indices) & (abs(A.data) >= theta * numpy.sqrt(absdiag[A.rows] * absdiag[A.indices]))
+    rows = A.rows[strong]
+    cols = A.indices[strong]
+    G = _CSR.fromcoo(numpy.ones(2*len(rows)), numpy.hstack([rows, cols]), numpy.hstack([cols, rows]), A.shape) # symmetrized strength graph
+    # select roots via a randomized maximal independent set in the square of G
+    weights = numpy.random.RandomState(0).permutation(A.shape[0]) + 1
+    state = numpy.zeros(A.shape[0], dtype=int) # 0: undecided, 1: root, -1: within two connections of a root
+    while not state.all():
+      candidates = numpy.where(state == 0, weights, 0)
+      isroot = (candidates > 0) & (candidates == G.rowmax(G.rowmax(candidates)))
+      state[isroot] = 1
+      state[(state == 0) & (G.rowmax(G.rowmax(isroot.astype(int))) > 0)] = -1
+    iagg = numpy.full(A.shape[0], -1)
+    iagg[state == 1] = numpy.arange((state == 1).sum())
+    for i in range(2): # join aggregates of neighbours, respectively next-nearest neighbours, of roots
+      iagg = numpy.where(iagg < 0, G.rowmax(iagg), iagg)
+    assert (iagg >= 0).all()
+    return iagg
+
+  @staticmethod
+  def _spectralradius(A, dinv, niter=15):
+    '''Estimate the spectral radius of the Jacobi preconditioned matrix by power
+    iteration.'''
+
+    x = numpy.random.RandomState(0).uniform(.5, 1, size=A.shape[0])
+    rho = 1.
+    for i in range(niter):
+      y = dinv * (A @ x)
+      ynorm = numpy.linalg.norm(y)
+      if not ynorm:
+        break
+      rho = ynorm / numpy.linalg.norm(x)
+      x = y / ynorm
+    return rho
+
+  def __call__(self, rhs):
+    return self._cycle(0, numpy.asarray(rhs, dtype=float))
+
+  def _cycle(self, ilevel, rhs):
+    if ilevel == len(self.levels):
+      return self.coarse @ rhs
+    A, wdinv, P, R = self.levels[ilevel]
+    lhs = wdinv * rhs
+    lhs += P @ self._cycle(ilevel+1, R @ (rhs - A @ lhs))
+    lhs += wdinv * (rhs - A @ lhs)
+    return lhs
+
+## FIELD SPLIT
+
+class FieldSplit(types.Immutable):
+  '''Block preconditioner for systems that combine multiple fields.
+
+  The preconditioner partitions the dofs of a square system into fields,
+  such as the velocity and pressure dofs of a saddle point problem formed via
+  :func:`nutils.function.chain`, and approximately inverts the resulting
+  block system by solving for one field at a time. Blocks are extracted via
+  :meth:`Matrix.submatrix`. A field split object can be passed as the
+  ``precon`` argument of :meth:`Matrix.solve` for the iterative solvers of the
+  SciPy and MKL backends, in which case the fields refer to all dofs of the
+  unconstrained system::
+
+      precon = matrix.FieldSplit([udofs, pdofs], mode='upper')
+      lhs = A.solve(rhs, constrain=cons, solver='gmres', atol=1e-10, precon=precon)
+
+  Args
+  ----
+  fields : :class:`tuple` of :class:`bool`/:class:`int` arrays
+      Dof selections of the fields, which should partition all dofs.
+  mode : :class:`str`
+      Block structure of the preconditioner: 'diag' for block diagonal,
+      'lower' for block lower triangular, 'upper' for block upper triangular.
+  schur : :class:`str`
+      Approximation of the diagonal blocks of all but the first field: 'diag'
+      for the Schur complement ``A_ii - sum_j A_ij diag(D_j)^-1 A_ji`` with
+      respect to all preceding fields ``j`` with diagonal blocks ``D_j``,
+      'none' for the diagonal blocks ``A_ii`` of the matrix itself.
+  blocks : :class:`str`
+      Approximate inverse of the diagonal blocks: 'direct' for a direct solve,
+      'amg' for an algebraic multigrid cycle, 'diag' for the inverse diagonal.
+  '''
+
+  @types.apply_annotations
+  def __init__(self, fields:types.tuple[types.frozenarray], mode:str='lower', schur:str='diag', blocks:str='direct'):
+    if mode not in ('diag', 'lower', 'upper'):
+      raise ValueError('invalid mode {!r}'.format(mode))
+    if schur not in ('diag', 'none'):
+      raise ValueError('invalid schur complement approximation {!r}'.format(schur))
+    if blocks not in ('direct', 'amg', 'diag'):
+      raise ValueError('invalid block inverse {!r}'.format(blocks))
+    self.fields = fields
+    self.mode = mode
+    self.schur = schur
+    self.blocks = blocks
+
+  def restrict(self, dofs):
+    '''Return the field split for the system restricted to the selected dofs.'''
+
+    dofs = numeric.asboolean(dofs, len(dofs))
+    if dofs.all():
+      return self
+    return FieldSplit(tuple(numeric.asboolean(field, len(dofs), ordered=False)[dofs] for field in self.fields), self.mode, self.schur, self.blocks)
+
+  def build(self, matrix):
+    '''Return the preconditioner of ``matrix`` as a function of the residual.'''
+
+    n, ncols = matrix.shape
+    if n != ncols:
+      raise MatrixError('field split requires a square matrix')
+    fields = [numeric.asboolean(field, n, ordered=False) for field in self.fields]
+    if not (sum(field.astype(int) for field in fields) == 1).all():
+      raise MatrixError('fields do not partition the dofs')
+    offdiag = {(i, j): matrix.submatrix(fi, fj) for i, fi in enumerate(fields) for j, fj in enumerate(fields)
+      if i > j and (self.mode == 'lower' or self.schur == 'diag') or i < j and (self.mode == 'upper' or self.schur == 'diag')}
+    diag = []
+    for i, field in enumerate(fields):
+      block = matrix.submatrix(field, field)
+      if self.schur == 'diag':
+        for j in range(i):
+          dj = diag[j].diagonal()
+          if not dj.all():
+            raise MatrixError("building 'diag' schur complement: diagonal has zero entries")
+          Aji = _CSR(*offdiag[j,i].export('csr'), field.sum())
+          Aji.data = Aji.data / dj[Aji.rows]
+          prod = _CSR(*offdiag[i,j].export('csr'), fields[j].sum()) @ Aji
+          block -= assemble(prod.data, (prod.rows, prod.indices), prod.shape)
+      diag.append(block)
+    inverses = [self._inverse(block) for block in diag]
+    order = range(len(fields)) if self.mode != 'upper' else range(len(fields)-1, -1, -1)
+    def precon(rhs):
+      lhs = numpy.zeros_like(rhs, dtype=float)
+      done = []
+      for i in order:
+        res = rhs[fields[i]]
+        if self.mode != 'diag':
+          for j in done:
+            res = res - offdiag[i,j] @ lhs[fields[j]]
+        lhs[fields[i]] = inverses[i](res)
+        done.append(i)
+      return lhs
+    return precon
+
+  def _inverse(self, block):
+    if self.blocks == 'direct':
+      return functools.partial(block.solve_direct, atol=numpy.inf) # skip refinement
+    if self.blocks == 'amg':
+      return block._amg()
+    diag = block.diagonal()
+    if not diag.all():
+      raise MatrixError("building 'diag' block inverse: diagonal has zero entries")
+    return numpy.reciprocal(diag).__mul__
+
 ## MODULE METHODS
 
 _current_backend = Numpy()
@@ -812,7 +1524,8 @@ def assemble(data, index, shape):
   return _current_backend.assemble(data, index, shape)
 
 def fromsparse(data, inplace=False):
-  indices, values, shape = sparse.extract(sparse.prune(sparse.dedup(data, inplace=inplace), inplace=True))
+  dedup = sparse.dedup(data, inplace=inplace)
+  indices, values, shape = sparse.extract(sparse.prune(dedup, inplace=inplace or dedup is not data))
   return _current_backend.assemble(values, indices, shape)
 
 def empty(shape):
@@ -825,7 +1538,7 @@ def diag(d):
 def eye(n):
   return diag(numpy.ones(n))
 
-backend = typing.Union[Numpy,Scipy,MKL]
+backend = typing.Union[Numpy,Scipy,MKL,CSR]
 auto = MKL() or Scipy() or Numpy()
 
 # vim:sw=2:sts=2:et
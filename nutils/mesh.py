@@ -67,9 +67,21 @@ def rectilinear(richshape, periodic=(), name='rect'):
       scale = scale[0]
     geom = function.rootcoords(ndims) * scale + offset
   else:
-    funcsp = topo.basis('spline', degree=1, periodic=())
-    coords = numeric.meshgrid(*richshape).reshape(ndims, -1)
-    geom = (funcsp * coords).sum(-1)
+    # The geometry is affine in every element, with a scale and offset per
+    # dimension that we tabulate for all elements such that the Jacobian, its
+    # inverse and determinant are evaluated once per element rather than in
+    # every point.
+    scales = []
+    offsets = []
+    for v in richshape:
+      v = numpy.arange(v+1, dtype=float) if numeric.isint(v) else numpy.asarray(v, dtype=float)
+      h = numpy.diff(v)
+      scales.append(h)
+      offsets.append(v[:-1] - h * numpy.arange(len(h)))
+    scale = numeric.meshgrid(*scales).reshape(ndims, -1).T
+    offset = numeric.meshgrid(*offsets).reshape(ndims, -1).T
+    index = topo.f_index
+    geom = function.get(types.frozenarray(offset, copy=False), 0, index) + function.get(types.frozenarray(scale, copy=False), 0, index) * function.rootcoords(ndims)
 
   return topo, geom
 
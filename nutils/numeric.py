@@ -133,12 +133,18 @@ def normalize(A, axis=-1):
   s[axis] = numpy.newaxis
   return A / numpy.linalg.norm(A, axis=axis)[tuple(s)]
 
-def diagonalize(arg, axis=-1, newaxis=-1):
-  'insert newaxis, place axis on diagonal of axis and newaxis'
+def diagonalize(arg, axis=-1, newaxis=-1, out=None):
+  'insert newaxis, place axis on diagonal of axis and newaxis, optionally overwriting out'
   axis = normdim(arg.ndim, axis)
   newaxis = normdim(arg.ndim+1, newaxis)
   assert 0 <= axis < newaxis <= arg.ndim
-  diagonalized = numpy.zeros(arg.shape[:newaxis]+(arg.shape[axis],)+arg.shape[newaxis:], arg.dtype)
+  shape = arg.shape[:newaxis]+(arg.shape[axis],)+arg.shape[newaxis:]
+  if out is None:
+    diagonalized = numpy.zeros(shape, arg.dtype)
+  else:
+    assert out.shape == shape
+    diagonalized = out
+    diagonalized.fill(0)
   diag = takediag(diagonalized, axis, newaxis)
   assert diag.base is diagonalized
   diag.flags.writeable = True
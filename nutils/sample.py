@@ -45,10 +45,169 @@ efficiently combine common substructures.
 
 from . import types, points, util, function, parallel, numeric, matrix, transformseq, sparse
 from .pointsseq import PointsSequence
-import numpy, numbers, collections.abc, os, treelog as log, abc
+import numpy, numbers, collections.abc, os, treelog as log, abc, contextlib, tempfile
 
 graphviz = os.environ.get('NUTILS_GRAPHVIZ')
 
+class _LRUCache:
+  '''Least recently used cache of argument independent values.
+
+  Entries are tuples of values, of which the arrays count towards the memory
+  cap of ``maxbytes``. If the cap is exceeded the least recently used entries
+  are evicted; entries that exceed the cap by themselves are not stored.'''
+
+  def __init__(self, maxbytes):
+    self.maxbytes = maxbytes
+    self.nbytes = 0
+    self._data = collections.OrderedDict()
+
+  def __getitem__(self, key):
+    value, nbytes = self._data[key]
+    self._data.move_to_end(key)
+    return value
+
+  def __setitem__(self, key, value):
+    nbytes = sum(numpy.asarray(v).nbytes for v in value if numeric.isarray(v))
+    if nbytes > self.maxbytes:
+      return
+    if key in self._data:
+      self.nbytes -= self._data.pop(key)[1]
+    self._data[key] = value, nbytes
+    self.nbytes += nbytes
+    while self.nbytes > self.maxbytes:
+      self.nbytes -= self._data.popitem(last=False)[1][1]
+
+  def __len__(self):
+    return len(self._data)
+
+_elemcache = _LRUCache(2**27)
+
+@contextlib.contextmanager
+def elemcache(maxbytes: int):
+  '''Set the memory cap of the element cache.
+
+  Element-wise evaluation of functions stores the values of subexpressions
+  that do not depend on any argument, such as the geometry, its Jacobian and
+  basis function values and gradients, and reuses them in subsequent
+  evaluations on the same sample. As a result, repeated integration of the
+  same integrands, such as in every iteration of a nonlinear or time-stepping
+  solve, only pays for the argument dependent part. The cache is shared by
+  all samples, limited to ``maxbytes`` (default: 128MiB) and evicts least
+  recently used elements first. A value of zero disables the cache. Values
+  that are computed in forked processes are not retained.
+
+  Args
+  ----
+  maxbytes : :class:`int`
+      Memory cap in bytes.
+  '''
+
+  if not isinstance(maxbytes, int) or maxbytes < 0:
+    raise ValueError('maxbytes requires a non-negative integer argument')
+  global _elemcache
+  old = _elemcache
+  _elemcache = _LRUCache(maxbytes) if maxbytes else None
+  try:
+    yield
+  finally:
+    _elemcache = old
+
+_patterncache = _LRUCache(2**28)
+
+@contextlib.contextmanager
+def patterncache(maxbytes: int):
+  '''Set the memory cap of the sparsity pattern cache.
+
+  Integration of functions into sparse data stores, per sample and integrand
+  structure, the deduplicated indices of the result along with the position
+  of every element contribution therein, provided that the indices do not
+  depend on any argument. Subsequent integrations of the same structure skip
+  the evaluation of indices and scatter the element values straight into the
+  fixed pattern. The cache is limited to ``maxbytes`` (default: 256MiB) and
+  evicts least recently used patterns first. A value of zero disables the
+  cache.
+
+  Args
+  ----
+  maxbytes : :class:`int`
+      Memory cap in bytes.
+  '''
+
+  if not isinstance(maxbytes, int) or maxbytes < 0:
+    raise ValueError('maxbytes requires a non-negative integer argument')
+  global _patterncache
+  old = _patterncache
+  _patterncache = _LRUCache(maxbytes) if maxbytes else None
+  try:
+    yield
+  finally:
+    _patterncache = old
+
+_assemblybudget = None
+
+@contextlib.contextmanager
+def assemblybudget(maxbytes: int):
+  '''Assemble sparse data in element chunks within a memory budget.
+
+  By default, integration into sparse data allocates memory for the values
+  and indices of all elements at once, before deduplication, which for
+  vector valued problems in three dimensions can be several times the size
+  of the result. Within this context, elements are instead processed in
+  consecutive chunks of which the raw sparse data does not exceed
+  ``maxbytes``, unless a single batch of elements does so by itself. Every
+  chunk is deduplicated and merged into the result before the next is
+  evaluated, such that peak memory scales with the size of the result
+  rather than with the number of elements. Chunked assembly bypasses the
+  sparsity pattern cache.
+
+  Args
+  ----
+  maxbytes : :class:`int`
+      Memory budget in bytes.
+  '''
+
+  if not isinstance(maxbytes, int) or maxbytes <= 0:
+    raise ValueError('maxbytes requires a positive integer argument')
+  global _assemblybudget
+  old = _assemblybudget
+  _assemblybudget = maxbytes
+  try:
+    yield
+  finally:
+    _assemblybudget = old
+
+_scratchdir = None
+
+@contextlib.contextmanager
+def scratchdir(dirname: str):
+  '''Store sparse integration data in memory mapped files.
+
+  Within this context, integration into sparse data allocates its raw values
+  and indices in temporary, memory mapped files in directory ``dirname``
+  rather than in memory, which allows the assembly of systems that exceed
+  the available memory. Additionally, :func:`eval_integrals_sparse` writes
+  its deduplicated results to ``.npy`` files in the same directory and
+  returns them as memory maps, of which the ``filename`` attribute can be
+  used to hand the data to an external solver. These files are not removed.
+  Chunked assembly (see :func:`assemblybudget`) bounds the memory for the
+  deduplication of the raw data. The sparsity pattern cache is bypassed.
+
+  Args
+  ----
+  dirname : :class:`str`
+      Path of an existing directory.
+  '''
+
+  if not os.path.isdir(dirname):
+    raise ValueError('scratch directory {!r} does not exist'.format(dirname))
+  global _scratchdir
+  old = _scratchdir
+  _scratchdir = dirname
+  try:
+    yield
+  finally:
+    _scratchdir = old
+
 def argdict(arguments):
   if len(arguments) == 1 and 'arguments' in arguments and isinstance(arguments['arguments'], collections.abc.Mapping):
     arguments = arguments['arguments']
@@ -73,7 +232,9 @@ class Sample(types.Singleton):
   '''
 
   __slots__ = 'nelems', 'transforms', 'points', 'ndims'
-  __cache__ = 'allcoords'
+  __cache__ = 'allcoords', '_batches'
+
+  batchsize = 1
 
   @staticmethod
   @types.apply_annotations
@@ -137,6 +298,51 @@ class Sample(types.Singleton):
   def _prepare_funcs(self, funcs):
     return [function.asarray(func).prepare_eval(ndims=self.ndims) for func in funcs]
 
+  def batched(self, batchsize):
+    '''Evaluate in batches of elements.
+
+    Return a copy of this sample that evaluates functions on up to
+    ``batchsize`` consecutive elements at once, provided that they share a
+    point set. See :meth:`nutils.function.Evaluable.eval_batched` for details.
+
+    Args
+    ----
+    batchsize : :class:`int`
+        Maximum number of elements per batch.
+
+    Returns
+    -------
+    batched : :class:`Sample`
+    '''
+
+    return _Batched(self, batchsize) if batchsize > 1 else self
+
+  @property
+  def _batches(self):
+    '''Tuple of ranges of at most ``batchsize`` consecutive elements that share
+    a point set.'''
+
+    if self.batchsize == 1:
+      return tuple(range(ielem, ielem+1) for ielem in range(self.nelems))
+    starts = [0] if self.nelems else []
+    for ielem in range(1, self.nelems):
+      if ielem - starts[-1] == self.batchsize or self.points[ielem] != self.points[starts[-1]]:
+        starts.append(ielem)
+    return tuple(map(range, starts, starts[1:]+[self.nelems]))
+
+  def _eval_batch(self, func, ielems, arguments):
+    '''Evaluate ``func`` on elements ``ielems``, which share a point set.'''
+
+    transforms = [tuple(t[ielem] for t in self.transforms) for ielem in ielems]
+    coords = self.points[ielems[0]].coords
+    if function._profile is not None:
+      return [func.eval(_transforms=t, _points=coords, **arguments) for t in transforms]
+    if len(ielems) == 1 and _elemcache is not None:
+      return [func.compiled.eval_cached(_elemcache, (self, func, ielems[0]), _transforms=transforms[0], _points=coords, **arguments)]
+    if len(ielems) == 1:
+      return [func.compiled(_transforms=transforms[0], _points=coords, **arguments)]
+    return func.eval_batched(transforms, _points=coords, **arguments)
+
   @util.positional_only
   @util.single_or_multiple
   @types.apply_annotations
@@ -185,42 +391,162 @@ class Sample(types.Singleton):
     if graphviz:
       function.Tuple(values).graphviz(graphviz)
 
+    # Unless the indices depend on arguments, the sparsity pattern of the
+    # result is formed directly from the indices, such as the dof maps of
+    # bases, and stored in the pattern cache, in which case only the values
+    # need to be evaluated and summed into place.
+
+    indexfunc = function.Tuple(indices)
+    patternkey = self, tuple(block2func), tuple(func.shape for func in funcs), indexfunc
+    usepattern = _patterncache is not None and _assemblybudget is None and _scratchdir is None and _iselementwise(indexfunc)
+    pattern = None
+    if usepattern:
+      try:
+        pattern = _patterncache[patternkey]
+      except KeyError:
+        pattern = self._pattern(indexfunc, block2func, funcs, arguments)
+        if pattern is not None:
+          _patterncache[patternkey] = pattern
+    if pattern is not None:
+      offsets, patindices, inverses = pattern[0], pattern[1:len(funcs)+1], pattern[len(funcs)+1:]
+      return self._integrate_pattern(function.Tuple(values), block2func, offsets, patindices, inverses, arguments)
+
     # To allocate (shared) memory for all block data we evaluate indexfunc to
-    # build an nblocks x nelems+1 offset array, and nblocks index lists of
-    # length nelems.
+    # build an nblocks x nelems array of sizes.
 
-    offsets = numpy.zeros((len(blocks), self.nelems+1), dtype=int)
+    sizes = numpy.zeros((len(blocks), self.nelems), dtype=int)
     if blocks:
       sizefunc = function.stack([f.size for ifunc, ind, f in blocks]).simplified
-      for ielem, transforms in enumerate(zip(*self.transforms)):
-        n, = sizefunc.eval(_transforms=transforms, **arguments)
-        offsets[:,ielem+1] = offsets[:,ielem] + n
+      with function.bufferpool():
+        for ielems in self._batches:
+          for ielem, (n,) in zip(ielems, self._eval_batch(sizefunc, ielems, arguments)):
+            sizes[:,ielem] = n
+
+    # In a second, parallel element loop, value and index are evaluated and
+    # stored in shared memory using the offsets array for location. Each
+    # element has its own location so no locks are required. Within a memory
+    # budget, the elements are processed in chunks that are deduplicated and
+    # merged into the result one by one.
+
+    dtypes = [sparse.dtype(func.shape) for func in funcs]
+    valueindexfunc = function.Tuple(function.Tuple([value]+list(index)) for value, index in zip(values, indices))
+    log.debug('merged {} common subexpressions'.format(valueindexfunc.compiled.merged))
+    if _assemblybudget is None:
+      offsets, datas = self._integrate_batches(valueindexfunc, block2func, sizes, dtypes, self._batches, arguments)
+    else:
+      itemsizes = numpy.array([dtypes[ifunc].itemsize for ifunc in block2func], dtype=int)
+      chunks = [[]]
+      nbytes = 0
+      for ielems in self._batches:
+        n = itemsizes.dot(sizes[:,ielems.start:ielems.stop].sum(axis=1))
+        if chunks[-1] and nbytes + n > _assemblybudget:
+          chunks.append([])
+          nbytes = 0
+        chunks[-1].append(ielems)
+        nbytes += n
+      datas = [sparse.empty(func.shape) for func in funcs]
+      with log.iter.fraction('chunk', chunks) as items:
+        for batches in items:
+          offsets, chunkdatas = self._integrate_batches(valueindexfunc, block2func, sizes, dtypes, batches, arguments)
+          datas = [_add([data, sparse.dedup(chunkdata, inplace=True)]) for data, chunkdata in zip(datas, chunkdatas)]
+          del chunkdatas
+
+    if graphviz and function._profile is not None:
+      valueindexfunc.graphviz(graphviz, profile=function._profile)
+
+    return datas
+
+  def _integrate_batches(self, valueindexfunc, block2func, sizes, dtypes, batches, arguments):
+    '''Integrate the values and indices of ``valueindexfunc`` into sparse data
+    on the consecutive element ``batches``, returning the offsets of all
+    elements in the data along with the data.'''
 
     # Since several blocks may belong to the same function, we post process the
     # offsets to form consecutive intervals in longer arrays. The length of
     # these arrays is captured in the nfuncs-array nvals.
 
-    nvals = numpy.zeros(len(funcs), dtype=int)
+    ielem0, ielem1 = (batches[0].start, batches[-1].stop) if batches else (0, 0)
+    offsets = numpy.zeros((len(block2func), ielem1-ielem0+1), dtype=int)
+    nvals = numpy.zeros(len(dtypes), dtype=int)
     for iblock, ifunc in enumerate(block2func):
+      offsets[iblock,1:] = sizes[iblock,ielem0:ielem1].cumsum()
       offsets[iblock] += nvals[ifunc]
       nvals[ifunc] = offsets[iblock,-1]
 
-    # In a second, parallel element loop, value and index are evaluated and
-    # stored in shared memory using the offsets array for location. Each
-    # element has its own location so no locks are required.
-
-    datas = [parallel.shempty(n, dtype=sparse.dtype(funcs[ifunc].shape)) for ifunc, n in enumerate(nvals)]
-    valueindexfunc = function.Tuple(function.Tuple([value]+list(index)) for value, index in zip(values, indices))
-    with parallel.ctxrange('integrating', self.nelems) as ielems:
-      for ielem in ielems:
-        points = self.points[ielem]
-        for iblock, (intdata, *indices) in enumerate(valueindexfunc.eval(_transforms=tuple(t[ielem] for t in self.transforms), _points=points.coords, **arguments)):
-          data = datas[block2func[iblock]][offsets[iblock,ielem]:offsets[iblock,ielem+1]].reshape(intdata.shape[1:])
-          numpy.einsum('p,p...->...', points.weights, intdata, out=data['value'])
-          for idim, ii in enumerate(indices):
-            data['index']['i'+str(idim)] = ii.reshape([-1]+[1]*(data.ndim-1-idim))
+    datas = [_empty(n, dtype) for dtype, n in zip(dtypes, nvals)]
+    with parallel.ctxrange('integrating', len(batches)) as ibatches, function.bufferpool():
+      for ibatch in ibatches:
+        ielems = batches[ibatch]
+        weights = self.points[ielems[0]].weights
+        for ielem, valueindex in zip(ielems, self._eval_batch(valueindexfunc, ielems, arguments)):
+          for iblock, (intdata, *indices) in enumerate(valueindex):
+            data = datas[block2func[iblock]][offsets[iblock,ielem-ielem0]:offsets[iblock,ielem-ielem0+1]].reshape(intdata.shape[1:])
+            numpy.einsum('p,p...->...', weights, intdata, out=data['value'])
+            for idim, ii in enumerate(indices):
+              data['index']['i'+str(idim)] = ii.reshape([-1]+[1]*(data.ndim-1-idim))
+    return offsets, datas
+
+  def _pattern(self, indexfunc, block2func, funcs, arguments):
+    '''Sparsity pattern of the integrals of ``funcs``, formed from the
+    indices ``indexfunc`` of all blocks, consisting of the nblocks x nelems+1
+    offsets of all element contributions, the sorted unique indices of every
+    function and the position therein of every contribution. Returns None
+    if the shape of any function exceeds the range of linear int64 keys.'''
+
+    if any(numpy.prod(func.shape, dtype=float) > numpy.iinfo(numpy.int64).max for func in funcs):
+      return None
+
+    # The element contributions of every block are represented by the
+    # lexicographically ordered integer keys of their indices.
+
+    elemkeys = [[] for ielem in range(self.nelems)]
+    with function.bufferpool():
+      for ielems in self._batches:
+        for ielem, blockindices in zip(ielems, self._eval_batch(indexfunc, ielems, arguments)):
+          for iblock, blockindex in enumerate(blockindices):
+            keys = numpy.zeros((), dtype=numpy.int64)
+            for ii, n in zip(blockindex, funcs[block2func[iblock]].shape):
+              keys = keys[...,numpy.newaxis] * n + ii
+            elemkeys[ielem].append(keys.ravel())
+
+    offsets = numpy.zeros((len(block2func), self.nelems+1), dtype=int)
+    nvals = numpy.zeros(len(funcs), dtype=int)
+    for iblock, ifunc in enumerate(block2func):
+      offsets[iblock,1:] = numpy.cumsum([len(keys[iblock]) for keys in elemkeys])
+      offsets[iblock] += nvals[ifunc]
+      nvals[ifunc] = offsets[iblock,-1]
 
-    return datas
+    patindices = []
+    inverses = []
+    for ifunc, func in enumerate(funcs):
+      keys = numpy.empty(nvals[ifunc], dtype=numpy.int64)
+      for iblock in numpy.equal(block2func, ifunc).nonzero()[0]:
+        for ielem, elemblockkeys in enumerate(elemkeys):
+          keys[offsets[iblock,ielem]:offsets[iblock,ielem+1]] = elemblockkeys[iblock]
+      unique, inverse = numpy.unique(keys, return_inverse=True)
+      index = numpy.empty(len(unique), dtype=sparse.dtype(func.shape)['index'])
+      for name, n in reversed(tuple(zip(index.dtype.names, func.shape))):
+        unique, index[name] = numpy.divmod(unique, n)
+      patindices.append(index)
+      inverses.append(inverse)
+    log.debug('formed sparsity pattern of {} entries'.format('+'.join(str(len(index)) for index in patindices)))
+    return (offsets,) + tuple(patindices) + tuple(inverses)
+
+  def _integrate_pattern(self, valuefunc, block2func, offsets, patindices, inverses, arguments):
+    '''Integrate the values of ``valuefunc`` into the sparsity pattern
+    formed by ``patindices`` and the entry positions ``inverses``.'''
+
+    values = [parallel.shempty(len(inverse), dtype=float) for inverse in inverses]
+    batches = self._batches
+    with parallel.ctxrange('integrating', len(batches)) as ibatches, function.bufferpool():
+      for ibatch in ibatches:
+        ielems = batches[ibatch]
+        weights = self.points[ielems[0]].weights
+        for ielem, blockvalues in zip(ielems, self._eval_batch(valuefunc, ielems, arguments)):
+          for iblock, intdata in enumerate(blockvalues):
+            data = values[block2func[iblock]][offsets[iblock,ielem]:offsets[iblock,ielem+1]].reshape(intdata.shape[1:])
+            numpy.einsum('p,p...->...', weights, intdata, out=data)
+    return [_scatteradd(index, inverse, value) for index, inverse, value in zip(patindices, inverses, values)]
 
   def integral(self, func):
     '''Create Integral object for postponed integration.
@@ -254,10 +580,16 @@ class Sample(types.Singleton):
     if graphviz:
       idata.graphviz(graphviz)
 
-    with parallel.ctxrange('evaluating', self.nelems) as ielems:
-      for ielem in ielems:
-        for ifunc, inds, data in idata.eval(_transforms=tuple(t[ielem] for t in self.transforms), _points=self.points[ielem].coords, **arguments):
-          numpy.add.at(retvals[ifunc], numpy.ix_(self.getindex(ielem), *[ind for (ind,) in inds]), data)
+    batches = self._batches
+    with parallel.ctxrange('evaluating', len(batches)) as ibatches, function.bufferpool():
+      for ibatch in ibatches:
+        ielems = batches[ibatch]
+        for ielem, blocks in zip(ielems, self._eval_batch(idata, ielems, arguments)):
+          for ifunc, inds, data in blocks:
+            numpy.add.at(retvals[ifunc], numpy.ix_(self.getindex(ielem), *[ind for (ind,) in inds]), data)
+
+    if graphviz and function._profile is not None:
+      idata.graphviz(graphviz, profile=function._profile)
 
     return retvals
 
@@ -386,6 +718,37 @@ class _CustomIndex(Sample):
   def getindex(self, ielem):
     return self._index[ielem]
 
+class _Batched(Sample):
+
+  __slots__ = '_parent', 'batchsize'
+
+  @types.apply_annotations
+  def __init__(self, parent:strictsample, batchsize:types.strictint):
+    self._parent = parent
+    self.batchsize = batchsize
+    super().__init__(parent.transforms, parent.points)
+
+  @property
+  def index(self):
+    return self._parent.index
+
+  def getindex(self, ielem):
+    return self._parent.getindex(ielem)
+
+  @property
+  def tri(self):
+    return self._parent.tri
+
+  @property
+  def hull(self):
+    return self._parent.hull
+
+  def subset(self, mask):
+    return self._parent.subset(mask).batched(self.batchsize)
+
+  def batched(self, batchsize):
+    return self._parent.batched(batchsize)
+
 class Integral(types.Singleton):
   '''Postponed integration.
 
@@ -599,10 +962,56 @@ def eval_integrals_sparse(*integrals: types.tuple[strictintegral], **arguments:
   with log.iter.fraction('topology', util.gather((di, iint) for iint, integral in enumerate(integrals) for di in integral._integrands)) as gathered:
     for sample, iints in gathered:
       for iint, retval in zip(iints, sample.integrate_sparse([integrals[iint]._integrands[sample] for iint in iints], arguments)):
-        retvals[iint].append(retval)
+        retvals[iint].append(sparse.dedup(retval, inplace=True)) # sorted runs are merged by the final dedup
       del retval
 
-  return [sparse.add(retval) for retval in retvals]
+  if _scratchdir is None:
+    return [sparse.dedup(sparse.add(retval), inplace=True) for retval in retvals]
+  return [_persist(_add(retval)) for retval in retvals]
+
+def _empty(n, dtype):
+  '''Uninitialized array of length ``n`` in shared memory, or in a temporary
+  file in the scratch directory.'''
+
+  if _scratchdir is None or not n:
+    return parallel.shempty(n, dtype=dtype)
+  return numpy.memmap(tempfile.TemporaryFile(dir=_scratchdir), dtype=dtype, mode='w+', shape=(n,))
+
+def _add(datas):
+  '''Deduplicated sum of sparse objects, using scratch files if enabled.'''
+
+  if _scratchdir is None:
+    return sparse.dedup(sparse.add(datas), inplace=True)
+  retval = _empty(sum(map(len, datas)), sparse.result_type(*[data.dtype for data in datas]))
+  numpy.concatenate(datas, out=retval)
+  return sparse.dedup(retval, inplace=True)
+
+def _persist(data):
+  '''Copy of sparse data in a new ``.npy`` file in the scratch directory.'''
+
+  fd, filename = tempfile.mkstemp(prefix='sparse', suffix='.npy', dir=_scratchdir)
+  os.close(fd)
+  retval = numpy.lib.format.open_memmap(filename, mode='w+', dtype=data.dtype, shape=data.shape)
+  n = sparse.chunksize // data.dtype.itemsize or 1
+  for i in range(0, len(data), n):
+    retval[i:i+n] = data[i:i+n]
+  retval.flush()
+  return retval
+
+def _iselementwise(func):
+  '''Test if ``func`` depends on no evaluation argument besides the element
+  and its points.'''
+
+  return all(isinstance(op, (function.Points, function.SelectChain)) for op, indices in func.serialized if 0 in indices)
+
+def _scatteradd(index, inverse, values):
+  '''Sparse object with indices ``index`` and values formed by summing
+  ``values`` per position ``inverse``.'''
+
+  data = numpy.empty(len(index), dtype=[('index', index.dtype), ('value', values.dtype)])
+  data['index'] = index
+  data['value'] = numpy.bincount(inverse, weights=values, minlength=len(index))
+  return data
 
 def _convert(data, inplace=False):
   '''Convert a two-dimensional sparse object to an appropriate object.
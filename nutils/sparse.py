@@ -116,7 +116,15 @@ def dedup(data, inplace=False):
   the input argument. Additionally, if ``inplace`` is true, the deduplication
   step reuses the input array's memory. This may affect the size of the array,
   which should no longer be used after deduplication in place. In case the
-  input has no duplicates the input array is returned.
+  input has no duplicates the input array is returned. Memory mapped data is
+  sorted via its structured indices, which avoids temporary arrays of the
+  size of the data.
+
+  Sorting is stable and adaptive: data that is already sorted is only checked,
+  and data that consists of a few sorted runs, such as the sum of
+  deduplicated objects formed by :func:`add`, is merged rather than sorted
+  from scratch, at a cost that is linear in the size of the data for a fixed
+  number of runs.
 
   >>> from nutils.sparse import dtype, dedup
   >>> from numpy import array
@@ -130,31 +138,22 @@ def dedup(data, inplace=False):
     return data
   if not ndim(data):
     return data['value'].sum()[numpy.newaxis].view(data.dtype)
-  data.view(numpy.void).sort(kind='stable') # stable = timsort
-  keep = data['index'][1:] != data['index'][:-1]
+  keys = None if isinstance(data, numpy.memmap) else _linearize(data) # memory maps are sorted in place
+  if keys is None:
+    return _dedup_structured(data, inplace)
+  if (keys[1:] < keys[:-1]).any():
+    order = keys.argsort(kind='stable')
+    keys = keys[order]
+    data['value'] = data['value'][order]
+    _delinearize(keys, data)
+  keep = keys[1:] != keys[:-1]
   if keep.all():
     return data
-  elif inplace:
-    buf = numpy.empty(chunksize // data.dtype.itemsize or 1, dtype=data.dtype)
-    n, = numpy.hstack([True, keep, True]).nonzero()
-    for i in range(0, len(n)-1, len(buf)):
-      s = numpy.diff(n[i:i+len(buf)+1])
-      overlap = i+len(s) > n[i]
-      chunk = buf[:len(s)] if overlap else data[i:i+len(s)]
-      numpy.take(data['index'], n[i:i+len(s)], out=chunk['index'])
-      chunk['value'].fill(0)
-      numpy.add.at(chunk['value'], numpy.arange(len(s)).repeat(s), data['value'][n[i]:n[i+len(s)]])
-      if overlap:
-        data[i:i+len(s)] = chunk
-    return _resize(data, len(n)-1)
-  else:
-    offsets = keep.cumsum()
-    dedup = numpy.empty(offsets[-1]+1, dtype=data.dtype)
-    dedup[0] = data[0]
-    numpy.compress(keep, data['index'][1:], out=dedup['index'][1:])
-    dedup['value'][1:].fill(0)
-    numpy.add.at(dedup['value'], offsets, data['value'][1:])
-    return dedup
+  n, = numpy.hstack([True, keep]).nonzero()
+  dedup = data[:len(n)] if inplace else numpy.empty(len(n), dtype=data.dtype)
+  dedup['value'] = numpy.add.reduceat(data['value'], n)
+  _delinearize(keys[n], dedup)
+  return _resize(data, len(n)) if inplace else dedup
 
 def prune(data, inplace=False):
   '''Prune zero values.
@@ -194,7 +193,9 @@ def add(datas):
   Returns the sum of a list of sparse objects by concatenating the sparse
   entries. The returned array is of the data type mandated by Numpy's promotion
   rules. In case ``datas`` contains only one item of nonzero length and this
-  item has the correct data type, then this array is returned as-is.
+  item has the correct data type, then this array is returned as-is. Inputs
+  that are deduplicated prior to addition form sorted runs in the result, which
+  :func:`dedup` subsequently merges in linear time.
 
   >>> from nutils.sparse import dtype, add
   >>> from numpy import array
@@ -229,7 +230,9 @@ def toarray(data):
   if not shape:
     return values.sum()
   retval = numpy.zeros(shape, values.dtype)
-  numpy.add.at(retval, indices, values)
+  n = chunksize // data.dtype.itemsize or 1
+  for i in range(0, len(data), n):
+    numpy.add.at(retval, tuple(index[i:i+n] for index in indices), values[i:i+n])
   return retval
 
 def fromarray(data):
@@ -255,6 +258,56 @@ def fromarray(data):
 def _dtype(itype, vtype):
   return numpy.dtype([('index', itype), ('value', vtype)])
 
+def _linearize(data):
+  # Lexicographically ordered int64 keys of the sparse indices, or None if
+  # the shape exceeds the int64 range.
+  size = 1
+  for n in shape(data):
+    size *= n
+  if size > numpy.iinfo(numpy.int64).max:
+    return None
+  index = data['index']
+  keys = numpy.zeros(len(data), dtype=numpy.int64)
+  for name, n in zip(index.dtype.names, shape(data)):
+    keys *= n
+    keys += index[name]
+  return keys
+
+def _delinearize(keys, data):
+  # Inverse of _linearize: write the sparse indices corresponding to keys.
+  index = data['index']
+  for name, n in reversed(tuple(zip(index.dtype.names, shape(data)))):
+    keys, index[name] = numpy.divmod(keys, n)
+
+def _dedup_structured(data, inplace):
+  # Deduplication via the structured indices, for shapes that do not fit
+  # linearized keys.
+  data.view(numpy.void).sort(kind='stable') # stable = timsort
+  keep = data['index'][1:] != data['index'][:-1]
+  if keep.all():
+    return data
+  elif inplace:
+    buf = numpy.empty(chunksize // data.dtype.itemsize or 1, dtype=data.dtype)
+    n, = numpy.hstack([True, keep, True]).nonzero()
+    for i in range(0, len(n)-1, len(buf)):
+      s = numpy.diff(n[i:i+len(buf)+1])
+      overlap = i+len(s) > n[i]
+      chunk = buf[:len(s)] if overlap else data[i:i+len(s)]
+      numpy.take(data['index'], n[i:i+len(s)], out=chunk['index'])
+      chunk['value'].fill(0)
+      numpy.add.at(chunk['value'], numpy.arange(len(s)).repeat(s), data['value'][n[i]:n[i+len(s)]])
+      if overlap:
+        data[i:i+len(s)] = chunk
+    return _resize(data, len(n)-1)
+  else:
+    offsets = keep.cumsum()
+    dedup = numpy.empty(offsets[-1]+1, dtype=data.dtype)
+    dedup[0] = data[0]
+    numpy.compress(keep, data['index'][1:], out=dedup['index'][1:])
+    dedup['value'][1:].fill(0)
+    numpy.add.at(dedup['value'], offsets, data['value'][1:])
+    return dedup
+
 def _resize(data, n):
   if data.base is not None:
     return data[:n]
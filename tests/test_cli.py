@@ -108,6 +108,9 @@ class setup(testing.TestCase):
   def test_matrix_numpy(self):
     self._test_matrix(matrix.Numpy())
 
+  def test_matrix_csr(self):
+    self._test_matrix(matrix.CSR())
+
   def test_nprocs(self):
     for n in 1, 2, 3:
       with self.subTest(nprocs=n), self._setup(nprocs=n):
@@ -1,4 +1,4 @@
-import numpy, itertools, pickle, warnings as _builtin_warnings
+import numpy, itertools, pickle, collections, unittest.mock, warnings as _builtin_warnings
 from nutils import *
 from nutils.testing import *
 _ = numpy.newaxis
@@ -58,6 +58,8 @@ class check(TestCase):
       self.assertArrayAlmostEqual(actual.simplified.eval(**evalargs), desired, decimal)
     with self.subTest('optimized'):
       self.assertArrayAlmostEqual(actual.simplified.optimized_for_numpy.eval(**evalargs), desired, decimal)
+    with self.subTest('compiled'):
+      self.assertArrayAlmostEqual(actual.simplified.optimized_for_numpy.compiled(**evalargs), desired, decimal)
     with self.subTest('sample'):
       self.assertArrayAlmostEqual(self.sample.eval(actual), desired, decimal)
 
@@ -559,6 +561,187 @@ class commutativity(TestCase):
     self.assertEqual(function.add(self.A, self.B) * function.dot(self.A, self.B, axes=[0]), function.dot(self.B, self.A, axes=[0]) * function.add(self.B, self.A))
 
 
+@parametrize
+class compiled(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.arg = function.Argument('arg', (2,))
+    self.f = (function.sin(self.arg) * function.asarray([1.,2.])).sum(0).prepare_eval().simplified
+    self.plan = function.EvaluationPlan(self.f, codegen=self.codegen)
+
+  def test_eval(self):
+    for arg in [0.,1.], [2.,-1.]:
+      self.assertAllAlmostEqual(self.plan(arg=numpy.array(arg)), self.f.eval(arg=numpy.array(arg)))
+
+  def test_instructions(self):
+    self.assertEqual(len(self.plan.instructions) + self.plan.merged, len(self.f.ordereddeps))
+
+  def test_source(self):
+    if self.codegen:
+      self.assertTrue(self.plan.source.startswith('def evaluate(v0):'))
+    else:
+      self.assertIsNone(self.plan.source)
+
+  def test_error(self):
+    with self.assertRaises(function.EvaluationError):
+      self.plan()
+
+  def test_cached(self):
+    self.assertIs(self.f.compiled, self.f.compiled)
+
+  def test_lastuses(self):
+    self.assertEqual(function._lastuses([(0,), (1,), (0, 1, 2), (3,)]), ((), (), (1, 2), (3,)))
+    self.assertEqual(function._lastuses([(0,), (1,), (0, 1, 2), (3,)], keep=[1]), ((), (), (2,), (3,)))
+    if self.codegen:
+      self.assertIn('  del ', self.plan.source)
+
+  def test_cse(self):
+    class Doubled(function.Evaluable):
+      def __init__(self, arg, tag):
+        super().__init__(args=[arg])
+      evalf = staticmethod(lambda arg: arg * 2)
+    class Negated(function.Evaluable):
+      def __init__(self, arg):
+        super().__init__(args=[arg])
+      def evalf(self, arg):
+        return -arg
+    arg = self.arg.prepare_eval()
+    f = function.Tuple([Negated(Doubled(arg, 'a')), Negated(Doubled(arg, 'b'))])
+    plan = function.EvaluationPlan(f, codegen=self.codegen)
+    self.assertEqual(plan.merged, 2)
+    a, b = plan(arg=numpy.array([1.,2.]))
+    self.assertAllEqual(a, [-2.,-4.])
+    self.assertAllEqual(b, [-2.,-4.])
+    self.assertEqual(function.EvaluationPlan(f, codegen=self.codegen, cse=False).merged, 0)
+
+  def test_eval_cached(self):
+    x = function.rootcoords(1).prepare_eval()
+    f = function.Tuple([(x * self.arg).prepare_eval().simplified, function.Sin(x).prepare_eval().simplified])
+    plan = function.EvaluationPlan(f, codegen=self.codegen)
+    trans = (transform.Identifier(1, 'test'),),
+    points = numpy.array([[.25],[.75]])
+    cache = {}
+    for arg in [0.,1.], [2.,-1.]:
+      evalargs = dict(_transforms=trans, _points=points, arg=numpy.array(arg))
+      for actual, desired in zip(plan.eval_cached(cache, 'key', **evalargs), f.eval(**evalargs)):
+        self.assertAllAlmostEqual(actual, desired)
+    self.assertEqual(list(cache), ['key'])
+
+compiled(codegen=True)
+compiled(codegen=False)
+
+
+class polyval_tables(TestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    stack.enter_context(unittest.mock.patch.object(function.Polyval, '_tables', collections.OrderedDict()))
+    self.op = function.Polyval(function.Argument('c', (2,3)), function.Argument('x', (1,)), ngrad=1)
+    self.coeffs = numpy.array([[[1.,2.,3.],[4.,5.,0.]]])
+    self.points = numpy.array([[0.],[.5],[1.]])
+
+  def test_reuse(self):
+    a = self.op.evalf(self.points, self.coeffs)
+    self.assertAllAlmostEqual(a, [[[2.],[5.]],[[5.],[5.]],[[8.],[5.]]])
+    self.assertIs(self.op.evalf(self.points.copy(), self.coeffs.copy()), a)
+    self.assertEqual(len(function.Polyval._tables), 1)
+
+  def test_distinct(self):
+    a = self.op.evalf(self.points, self.coeffs)
+    b = self.op.evalf(self.points, 2*self.coeffs)
+    self.assertAllAlmostEqual(b, 2*numpy.asarray(a))
+    self.assertEqual(len(function.Polyval._tables), 2)
+
+  def test_evict(self):
+    with unittest.mock.patch.object(function.Polyval, 'maxtables', 2):
+      for i in range(3):
+        self.op.evalf(self.points, i*self.coeffs)
+    self.assertEqual(len(function.Polyval._tables), 2)
+
+
+@parametrize
+class einsum(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    numpy.random.seed(0)
+    lengths = [4, 5, 3, 2, 6][:len(self.mask)]
+    self.arr1 = numpy.random.uniform(size=[self.npoints[0]]+[n for n, m in zip(lengths, self.mask) if m != 2])
+    self.arr2 = numpy.random.uniform(size=[self.npoints[1]]+[n for n, m in zip(lengths, self.mask) if m != 1])
+    self.op = function.Einsum(function.Argument('a', self.arr1.shape[1:]), function.Argument('b', self.arr2.shape[1:]), self.mask)
+    self.desired = numpy.einsum(self.op._einsumfmt, self.arr1, self.arr2)
+
+  def test_matmul(self):
+    self.assertIsNotNone(self.op._matmul)
+    with unittest.mock.patch.object(function.Einsum, '_matmulsize', 0):
+      self.assertAllAlmostEqual(self.op.evalf(self.arr1, self.arr2), self.desired)
+
+  def test_einsum(self):
+    with unittest.mock.patch.object(function.Einsum, '_matmulsize', float('inf')):
+      self.assertAllAlmostEqual(self.op.evalf(self.arr1, self.arr2), self.desired)
+
+for npoints in (3, 3), (1, 3), (3, 1):
+  einsum(mask=(1,0,2), npoints=npoints)
+  einsum(mask=(3,0), npoints=npoints)
+  einsum(mask=(2,0,3,1,0), npoints=npoints)
+
+
+class bufferpool(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.arg = function.Argument('arg', (2,))
+    self.f = function.Einsum(function.Diagonalize(self.arg, 0, 1), self.arg, (1,0)).prepare_eval().simplified
+
+  def test_reuse(self):
+    with function.bufferpool():
+      a = self.f.eval(arg=numpy.array([1.,2.]))
+      self.assertAllEqual(a, [1.,4.])
+      b = self.f.eval(arg=numpy.array([3.,4.]))
+      self.assertAllEqual(b, [9.,16.])
+    self.assertIs(a, b)
+
+  def test_disabled(self):
+    with function.bufferpool(), function.bufferpool(False):
+      a = self.f.eval(arg=numpy.array([1.,2.]))
+      b = self.f.eval(arg=numpy.array([3.,4.]))
+    self.assertIsNot(a, b)
+    self.assertAllEqual(a, [1.,4.])
+    self.assertAllEqual(b, [9.,16.])
+
+
+class profile(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.arg = function.Argument('arg', (2,))
+    self.f = (function.sin(self.arg) * function.asarray([1.,2.])).sum(0).prepare_eval().simplified
+
+  def test_record(self):
+    with function.profile() as prof:
+      for i in range(3):
+        self.f.eval(arg=numpy.array([0.,1.]))
+    self.assertEqual(set(prof.stats), set(self.f.ordereddeps[1:]+(self.f,)))
+    for ncalls, seconds, nbytes in prof.stats.values():
+      self.assertEqual(ncalls, 3)
+      self.assertGreaterEqual(seconds, 0)
+    self.assertEqual(prof.stats[self.f][2], 3*numpy.dtype(float).itemsize)
+    self.assertEqual(sum(ncalls for ncalls, seconds, nbytes in prof.byclass.values()), 3*len(prof.stats))
+
+  def test_inactive(self):
+    with function.profile() as prof:
+      pass
+    self.f.eval(arg=numpy.array([0.,1.]))
+    self.assertEqual(prof.stats, {})
+
+  def test_sample(self):
+    domain, geom = mesh.rectilinear([2,3])
+    with function.profile() as prof:
+      self.assertAlmostEqual(domain.integrate(function.J(geom), degree=1), 6)
+    self.assertEqual(prof.byclass['Determinant'][0], 6)
+
+
 @parametrize
 class sampled(TestCase):
 
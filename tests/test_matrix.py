@@ -1,4 +1,4 @@
-import numpy, pickle
+import numpy, pickle, contextlib, unittest.mock
 from nutils import matrix, sparse
 from nutils.testing import *
 
@@ -222,18 +222,202 @@ class solver(TestCase):
       self.assertIsInstance(mat, matrix.NumpyMatrix)
       numpy.testing.assert_equal(mat.export('dense'), self.exact)
 
+  @ifsupported
+  def test_update(self):
+    rhs = numpy.arange(self.matrix.shape[0])
+    self.matrix.solve(rhs)
+    values, indices, indptr = self.matrix.export('csr')
+    self.matrix.update(values * 2)
+    self.assertAllEqual(self.matrix.export('dense'), self.exact * 2)
+    for args in self.args:
+      with self.subTest(args.get('solver', 'direct')):
+        lhs = self.matrix.solve(rhs, **args)
+        res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+        self.assertLess(res, args.get('atol', 1e-10))
+
+  @ifsupported
+  def test_resolve(self):
+    with contextlib.ExitStack() as stack:
+      if isinstance(self.matrix, matrix.ScipyMatrix):
+        linalg = self.matrix.scipy.sparse.linalg
+        factorize = [stack.enter_context(unittest.mock.patch.object(linalg, name, wraps=getattr(linalg, name))) for name in ('splu', 'spilu')]
+      else:
+        factorize = []
+      for args in self.args:
+        with self.subTest(args.get('solver', 'direct')):
+          for i, rhs in enumerate(numpy.arange(self.n)[numpy.newaxis] * [[1], [-1], [.5]]):
+            lhs = self.matrix.solve(rhs, **args)
+            res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+            self.assertLess(res, args.get('atol', 1e-10))
+            if not i:
+              counts = [f.call_count for f in factorize]
+          self.assertEqual([f.call_count for f in factorize], counts) # factorizations are reused for subsequent right hand sides
+    self.assertLessEqual(sum(f.call_count for f in factorize), 3) # direct and splu precon share a factorization
+
+  @ifsupported
+  def test_mixed(self):
+    if not hasattr(self.matrix, 'solve_mixed'):
+      self.skipTest('mixed precision is not supported')
+    rhs = numpy.arange(self.n, dtype=float)
+    desired = self.matrix.solve(rhs)
+    unrefined = self.matrix.solve_mixed(rhs, atol=numpy.inf)
+    self.assertEqual(unrefined.dtype, float)
+    self.assertGreater(numpy.linalg.norm(unrefined - desired), 1e-8 * numpy.linalg.norm(desired)) # single precision
+    lhs = self.matrix.solve(rhs, solver='mixed')
+    numpy.testing.assert_allclose(lhs, desired, rtol=1e-10)
+
+  @ifsupported
+  def test_symmetric(self):
+    rhs = numpy.arange(self.n)
+    self.assertTrue(self.matrix._issymmetric())
+    for symmetric in None, True, False:
+      with self.subTest(symmetric=symmetric):
+        lhs = self.matrix.solve(rhs, symmetric=symmetric)
+        self.assertLess(numpy.linalg.norm(self.matrix @ lhs - rhs), 1e-10)
+    if isinstance(self.matrix, matrix.ScipyMatrix):
+      self.assertEqual(sorted(self.matrix._factors), ['splu', 'splu:symmetric'])
+    values, indices, indptr = self.matrix.export('csr')
+    rows = numpy.arange(self.n).repeat(numpy.diff(indptr))
+    for name, scale in ('indefinite', numpy.where((rows == indices) & (rows < self.n // 2), -1, 1)), ('nonsymmetric', numpy.where(indices > rows, 1.1, 1)):
+      with self.subTest(name):
+        self.matrix.update(values * scale)
+        self.assertEqual(self.matrix._issymmetric(), name != 'nonsymmetric')
+        lhs = self.matrix.solve(rhs)
+        self.assertLess(numpy.linalg.norm(self.matrix @ lhs - rhs), 1e-10)
+
+  @ifsupported
+  def test_update_matrix(self):
+    self.matrix.update(self.matrix * 3)
+    self.assertAllEqual(self.matrix.export('dense'), self.exact * 3)
+
+  @ifsupported
+  def test_update_invalid(self):
+    with self.assertRaises(matrix.MatrixError):
+      self.matrix.update(numpy.ones(3))
+    with self.assertRaises(matrix.MatrixError):
+      self.matrix.update(matrix.eye(3))
+
   @ifsupported
   def test_diagonal(self):
     self.assertAllEqual(self.matrix.diagonal(), numpy.diag(self.exact))
 
 
 solver('numpy', backend=matrix.Numpy(), args=[{}])
-solver('scipy', backend=matrix.Scipy(), args=[{},
+solver('csr', backend=matrix.CSR(), args=[{}, dict(solver='cg', atol=1e-5, precon='diag'), dict(solver='gmres', atol=1e-5), dict(solver='gmres', atol=1e-5, restart=5, precon='diag'),
+  dict(solver='bicgstab', atol=1e-5, precon='diag'), dict(solver='cg', atol=1e-5, precon='amg')])
+solver('scipy', backend=matrix.Scipy(), args=[{}, dict(solver='mixed'),
     dict(solver='gmres', atol=1e-5, restart=100, precon='spilu'),
     dict(solver='gmres', atol=1e-5, precon='splu'),
-    dict(solver='cg', atol=1e-5, precon='diag')]
+    dict(solver='cg', atol=1e-5, precon='diag'),
+    dict(solver='cg', atol=1e-5, precon='amg')]
  + [dict(solver=s, atol=1e-5) for s in ('bicg', 'bicgstab', 'cg', 'cgs', 'lgmres', 'minres')])
 for threading in matrix.MKL.Threading.SEQUENTIAL, matrix.MKL.Threading.TBB:
-  solver('mkl:{}'.format(threading.name.lower()), backend=matrix.MKL(threading=threading), args=[{},
+  solver('mkl:{}'.format(threading.name.lower()), backend=matrix.MKL(threading=threading), args=[{}, dict(solver='mixed'),
       dict(solver='fgmres', atol=1e-8),
-      dict(solver='fgmres', atol=1e-8, precon='diag')])
+      dict(solver='fgmres', atol=1e-8, precon='diag'),
+      dict(solver='fgmres', atol=1e-8, precon='amg')])
+
+
+class amg(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    m = 30
+    L = 2 * numpy.eye(m) - numpy.eye(m, m, -1) - numpy.eye(m, m, +1)
+    self.exact = numpy.kron(L, numpy.eye(m)) + numpy.kron(numpy.eye(m), L) # 2D laplacian
+    rows, self.indices = self.exact.nonzero()
+    self.data = self.exact[rows, self.indices]
+    self.indptr = rows.searchsorted(numpy.arange(m*m+1))
+    self.rhs = numpy.ones(m*m)
+
+  def test_hierarchy(self):
+    amg = matrix.AMG(self.data, self.indices, self.indptr, maxcoarse=50)
+    sizes = [A.shape[0] for A, wdinv, P, R in amg.levels] + [len(amg.coarse)]
+    self.assertGreater(len(sizes), 2)
+    self.assertEqual(sizes[0], len(self.rhs))
+    self.assertLessEqual(sizes[-1], 50)
+    self.assertTrue(all(n < 0.5 * m for m, n in zip(sizes[:-1], sizes[1:])))
+    self.assertEqual([len(iagg) for iagg in amg.aggregates], sizes[:-1])
+
+  def test_cg(self):
+    amg = matrix.AMG(self.data, self.indices, self.indptr, maxcoarse=50)
+    lhs = numpy.zeros_like(self.rhs)
+    res = self.rhs.copy()
+    z = amg(res)
+    p = z.copy()
+    for i in range(30):
+      Ap = self.exact @ p
+      alpha = (res @ z) / (p @ Ap)
+      lhs += alpha * p
+      newres = res - alpha * Ap
+      if numpy.linalg.norm(newres) < 1e-10:
+        break
+      newz = amg(newres)
+      p = newz + (newres @ newz) / (res @ z) * p
+      res, z = newres, newz
+    self.assertLess(i, 25) # unpreconditioned cg requires over 60 iterations
+    self.assertAllAlmostEqual(self.exact @ lhs, self.rhs, places=9)
+
+  def test_reuse(self):
+    amg = matrix.AMG(self.data, self.indices, self.indptr, maxcoarse=50)
+    amg2 = matrix.AMG(self.data * 2, self.indices, self.indptr, maxcoarse=50, aggregates=amg.aggregates)
+    self.assertAllAlmostEqual(amg2(self.rhs), amg(self.rhs) / 2)
+
+  def test_zerodiag(self):
+    with self.assertRaises(matrix.MatrixError):
+      matrix.AMG(numpy.ones(3), numpy.array([1,0,2]), numpy.array([0,1,2,3]), maxcoarse=1)
+
+
+class fieldsplit(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    numpy.random.seed(0)
+    nu, np = 12, 5
+    A = numpy.diag(numpy.random.uniform(1, 2, size=nu))
+    B = numpy.random.normal(size=(np, nu))
+    self.exact = numpy.block([[A, B.T], [B, numpy.zeros((np, np))]]) # saddle point system
+    self.fields = numpy.arange(nu), numpy.arange(nu, nu+np)
+    self.lhs = numpy.random.normal(size=nu+np)
+
+  def _preconditioned(self, precon):
+    with matrix.Numpy():
+      apply = precon.build(matrix.assemble(*self._coo(self.exact)))
+    return numpy.array([apply(col) for col in self.exact.T]).T
+
+  def _coo(self, array):
+    rows, cols = array.nonzero()
+    return array[rows, cols], (rows, cols), array.shape
+
+  def test_triangular(self):
+    for mode in 'lower', 'upper':
+      with self.subTest(mode):
+        T = self._preconditioned(matrix.FieldSplit(self.fields, mode=mode)) - numpy.eye(len(self.exact))
+        self.assertAllAlmostEqual(T @ T, numpy.zeros_like(T)) # exact schur complement: minimal polynomial (x-1)^2
+
+  def test_diag(self):
+    T = self._preconditioned(matrix.FieldSplit(self.fields, mode='diag'))
+    I = numpy.eye(len(T))
+    self.assertAllAlmostEqual((T - I) @ (T @ T - T + I), numpy.zeros_like(T)) # exact, negative definite schur complement: minimal polynomial (x-1)(x^2-x+1)
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      matrix.FieldSplit(self.fields, mode='symmetric')
+    with self.assertRaises(matrix.MatrixError):
+      matrix.FieldSplit(self.fields[:1]).build(matrix.eye(len(self.exact)))
+
+  def test_solve(self):
+    backend = matrix.Scipy()
+    if not backend:
+      self.skipTest('scipy backend is unavailable')
+    nu = len(self.fields[0])
+    self.exact[:nu,:nu] += .5 * (numpy.eye(nu, nu, -1) + numpy.eye(nu, nu, +1)) # non-diagonal velocity block
+    constrain = numpy.zeros(len(self.exact), dtype=bool)
+    constrain[[0, -1]] = True # constrain one dof of each field
+    rhs = self.exact @ self.lhs
+    with backend:
+      mat = matrix.assemble(*self._coo(self.exact))
+      for mode in 'diag', 'lower', 'upper':
+        with self.subTest(mode):
+          lhs = mat.solve(rhs, lhs0=self.lhs * constrain, constrain=constrain, solver='gmres', atol=1e-10, precon=matrix.FieldSplit(self.fields, mode=mode))
+          self.assertAllAlmostEqual(lhs, self.lhs)
@@ -138,3 +138,29 @@ class rectilinear(TestCase):
 
 rectilinear('new', method='newrectilinear')
 rectilinear('old', method='rectilinear')
+
+class nonuniform_rectilinear(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.nodes = numpy.linspace(0, 1, 5)**2, [0., .5, 2.], 2
+    self.domain, self.geom = mesh.rectilinear(self.nodes)
+
+  def test_geometry(self):
+    funcsp = self.domain.basis('spline', degree=1)
+    coords = numeric.meshgrid(self.nodes[0], self.nodes[1], numpy.arange(3.)).reshape(3, -1)
+    for topo in self.domain, self.domain.boundary, self.domain.refined:
+      with self.subTest(topo=topo):
+        geom, desired = topo.sample('gauss', 2).eval([self.geom, (funcsp * coords).sum(-1)])
+        numpy.testing.assert_almost_equal(geom, desired, decimal=14)
+
+  def test_volume(self):
+    volume = self.domain.integrate(function.J(self.geom), degree=1)
+    numpy.testing.assert_almost_equal(volume, 4, decimal=14)
+
+  def test_affine(self):
+    J = function.J(self.geom).prepare_eval(ndims=3).simplified
+    points = self.domain.sample('gauss', 2).points[0].coords
+    value = J.eval(_transforms=(self.domain.transforms[5],)*2, _points=points)
+    self.assertEqual(value.shape, (1,))
+    self.assertAlmostEqual(value[0], (self.nodes[0][2] - self.nodes[0][1]) * .5)
@@ -1,5 +1,6 @@
 from nutils import *
-import random, itertools, functools
+from nutils import sparse
+import random, itertools, functools, unittest.mock, tempfile, os
 from nutils.testing import *
 
 class rectilinear(TestCase):
@@ -47,6 +48,248 @@ class rectilinear(TestCase):
     arg = function.Argument('dofs', [2,3])
     self.assertTrue(function.iszero(function.derivative(sampled, arg)))
 
+@parametrize
+class batched(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.ns = function.Namespace()
+    self.topo, self.ns.x = mesh.unitsquare(4, self.etype)
+    self.ns.basis = self.topo.basis('std', degree=2).vector(2)
+    self.ns.u_i = 'basis_ni ?lhs_n'
+    self.ns.sig_ij = 'u_i,j + u_j,i'
+    self.lhs = numpy.sin(numpy.arange(len(self.ns.basis)))
+    self.gauss = self.topo.sample('gauss', 3)
+    self.batched = self.gauss.batched(5)
+
+  def test_batches(self):
+    batches = self.batched._batches
+    self.assertEqual(sum(map(len, batches)), self.gauss.nelems)
+    for ielems in batches:
+      self.assertLessEqual(len(ielems), 5)
+      self.assertTrue(all(self.gauss.points[ielem] == self.gauss.points[ielems[0]] for ielem in ielems))
+
+  def test_integrate(self):
+    res = self.ns.eval_n('(basis_ni,j sig_ij + basis_ni x_i) d:x')
+    jac = function.derivative(res, function.Argument('lhs', self.lhs.shape))
+    desired = self.gauss.integrate([res, jac], arguments=dict(lhs=self.lhs))
+    actual = self.batched.integrate([res, jac], arguments=dict(lhs=self.lhs))
+    self.assertAllAlmostEqual(actual[0], desired[0], places=12)
+    self.assertAllAlmostEqual(actual[1].export('dense'), desired[1].export('dense'), places=12)
+
+  def test_eval(self):
+    desired = self.gauss.eval(self.ns.sig, arguments=dict(lhs=self.lhs))
+    actual = self.batched.eval(self.ns.sig, arguments=dict(lhs=self.lhs))
+    self.assertAllAlmostEqual(actual, desired, places=12)
+
+  def test_eval_batched(self):
+    func = self.ns.eval_ij('sig_ij + x_i x_j').prepare_eval(ndims=2).simplified.optimized_for_numpy
+    coords = self.gauss.points[0].coords
+    transforms = [tuple(t[ielem] for t in self.gauss.transforms) for ielem in self.batched._batches[0]]
+    actual = func.eval_batched(transforms, _points=coords, lhs=self.lhs)
+    self.assertEqual(len(actual), len(transforms))
+    for trans, value in zip(transforms, actual):
+      self.assertAllAlmostEqual(value, func.eval(_transforms=trans, _points=coords, lhs=self.lhs), places=12)
+
+  def test_subset(self):
+    subset = self.batched.subset(numpy.eye(self.batched.npoints)[0])
+    self.assertEqual(subset.batchsize, 5)
+
+batched(etype='square')
+batched(etype='triangle')
+batched(etype='mixed')
+
+class elemcache(TestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    stack.enter_context(sample.patterncache(0))
+
+  def setUp(self):
+    super().setUp()
+    self.domain, geom = mesh.unitsquare(4, 'square')
+    self.basis = self.domain.basis('std', degree=2)
+    self.lhs = function.Argument('lhs', [len(self.basis)])
+    u = self.basis.dot(self.lhs)
+    self.res = self.domain.integral((self.basis.grad(geom) * u.grad(geom) * (1 + u**2)).sum(-1) * function.J(geom), degree=4)
+    self.sample, = self.res._integrands
+    numpy.random.seed(0)
+    self.lhsvals = numpy.random.uniform(size=(2,len(self.basis)))
+
+  def test_reuse(self):
+    with sample.elemcache(0):
+      desired = [self.res.eval(lhs=lhs) for lhs in self.lhsvals]
+    with sample.elemcache(2**24):
+      for lhs, des in zip(self.lhsvals, desired):
+        self.assertAllAlmostEqual(self.res.eval(lhs=lhs), des)
+      self.assertEqual(len(sample._elemcache), 2*self.sample.nelems) # sizes and values
+      self.assertGreater(sample._elemcache.nbytes, 0)
+
+  def test_evict(self):
+    with sample.elemcache(2**24):
+      self.res.eval(lhs=self.lhsvals[0])
+      nbytes = sample._elemcache.nbytes
+    with sample.elemcache(nbytes // 4):
+      self.assertAllAlmostEqual(self.res.eval(lhs=self.lhsvals[0]), self.res.eval(lhs=self.lhsvals[0]))
+      self.assertLess(len(sample._elemcache), 2*self.sample.nelems)
+      self.assertLessEqual(sample._elemcache.nbytes, nbytes // 4)
+
+  def test_disable(self):
+    with sample.elemcache(0):
+      self.assertIsNone(sample._elemcache)
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      with sample.elemcache(-1):
+        pass
+
+class assemblybudget(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.domain, geom = mesh.unitsquare(4, 'square')
+    self.basis = self.domain.basis('std', degree=2)
+    self.lhs = function.Argument('lhs', [len(self.basis)])
+    u = self.basis.dot(self.lhs)
+    self.res = self.domain.integral((self.basis.grad(geom) * u.grad(geom) * (1 + u**2)).sum(-1) * function.J(geom), degree=4)
+    self.jac = self.res.derivative('lhs')
+    numpy.random.seed(0)
+    self.lhsval = numpy.random.uniform(size=len(self.basis))
+
+  def test_chunks(self):
+    desired = sample.eval_integrals(self.res, self.jac, lhs=self.lhsval)
+    with sample.assemblybudget(2**12), unittest.mock.patch.object(sample.Sample, '_integrate_batches', autospec=True, side_effect=sample.Sample._integrate_batches) as integrate_batches:
+      actual = sample.eval_integrals(self.res, self.jac, lhs=self.lhsval)
+    self.assertGreater(integrate_batches.call_count, 2)
+    self.assertAllAlmostEqual(actual[0], desired[0])
+    self.assertAllAlmostEqual(actual[1].export('dense'), desired[1].export('dense'))
+
+  def test_sparse(self):
+    with sample.assemblybudget(2**12):
+      data, = sample.eval_integrals_sparse(self.jac, lhs=self.lhsval)
+    keys = numpy.ravel_multi_index(sparse.indices(data), sparse.shape(data))
+    self.assertTrue((keys[1:] > keys[:-1]).all()) # sorted and deduplicated
+    self.assertAllAlmostEqual(sparse.toarray(data), self.jac.eval(lhs=self.lhsval).export('dense'))
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      with sample.assemblybudget(0):
+        pass
+
+class scratchdir(TestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    self.dirname = stack.enter_context(tempfile.TemporaryDirectory())
+
+  def setUp(self):
+    super().setUp()
+    self.domain, geom = mesh.unitsquare(4, 'square')
+    self.basis = self.domain.basis('std', degree=2)
+    self.lhs = function.Argument('lhs', [len(self.basis)])
+    u = self.basis.dot(self.lhs)
+    self.res = self.domain.integral((self.basis.grad(geom) * u.grad(geom) * (1 + u**2)).sum(-1) * function.J(geom), degree=4)
+    self.jac = self.res.derivative('lhs') + self.domain.boundary.integral(function.outer(self.basis) * function.J(geom), degree=4)
+    numpy.random.seed(0)
+    self.lhsval = numpy.random.uniform(size=len(self.basis))
+
+  def test_files(self):
+    desired = [sparse.toarray(data) for data in sample.eval_integrals_sparse(self.res, self.jac, lhs=self.lhsval)]
+    with sample.scratchdir(self.dirname):
+      datas = sample.eval_integrals_sparse(self.res, self.jac, lhs=self.lhsval)
+    self.assertEqual(sorted(os.listdir(self.dirname)), sorted(os.path.basename(data.filename) for data in datas))
+    for data, des in zip(datas, desired):
+      self.assertIsInstance(data, numpy.memmap)
+      keys = numpy.ravel_multi_index(sparse.indices(data), sparse.shape(data))
+      self.assertTrue((keys[1:] > keys[:-1]).all()) # sorted and deduplicated
+      loaded = numpy.load(data.filename, mmap_mode='r')
+      self.assertEqual(loaded.dtype, data.dtype)
+      self.assertAllAlmostEqual(sparse.toarray(loaded), des)
+    self.assertAllAlmostEqual(matrix.fromsparse(datas[1]).export('dense'), desired[1])
+    self.assertAllAlmostEqual(sparse.toarray(numpy.load(datas[1].filename, mmap_mode='r')), desired[1]) # file unaffected by fromsparse
+
+  def test_budget(self):
+    desired = sample.eval_integrals(self.res, self.jac, lhs=self.lhsval)
+    with sample.scratchdir(self.dirname), sample.assemblybudget(2**12):
+      actual = sample.eval_integrals(self.res, self.jac, lhs=self.lhsval)
+    self.assertAllAlmostEqual(actual[0], desired[0])
+    self.assertAllAlmostEqual(actual[1].export('dense'), desired[1].export('dense'))
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      with sample.scratchdir(os.path.join(self.dirname, 'nonexistent')):
+        pass
+
+class multisample(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.domain, geom = mesh.unitsquare(4, 'square')
+    self.basis = self.domain.basis('std', degree=2)
+    self.jac = self.domain.integral(function.outer(self.basis.grad(geom)).sum(-1) * function.J(geom), degree=4) \
+      + self.domain.boundary.integral(function.outer(self.basis) * function.J(geom), degree=4)
+
+  def test_sparse(self):
+    with unittest.mock.patch.object(sparse, 'dedup', side_effect=sparse.dedup) as dedup:
+      data, = sample.eval_integrals_sparse(self.jac)
+    self.assertEqual(dedup.call_count, 3) # once per sample and once for the sum
+    keys = numpy.ravel_multi_index(sparse.indices(data), sparse.shape(data))
+    self.assertTrue((keys[1:] > keys[:-1]).all()) # sorted and deduplicated
+    self.assertAllAlmostEqual(sparse.toarray(data), self.jac.eval().export('dense'))
+
+class patterncache(TestCase):
+
+  def setUpContext(self, stack):
+    super().setUpContext(stack)
+    stack.enter_context(sample.patterncache(2**24))
+
+  def setUp(self):
+    super().setUp()
+    self.domain, geom = mesh.unitsquare(4, 'square')
+    self.basis = self.domain.basis('std', degree=2)
+    self.lhs = function.Argument('lhs', [len(self.basis)])
+    u = self.basis.dot(self.lhs)
+    self.res = self.domain.integral((self.basis.grad(geom) * u.grad(geom) * (1 + u**2)).sum(-1) * function.J(geom), degree=4)
+    self.jac = self.res.derivative('lhs')
+    numpy.random.seed(0)
+    self.lhsvals = numpy.random.uniform(size=(2,len(self.basis)))
+
+  def test_reuse(self):
+    with sample.patterncache(0):
+      desired = [sample.eval_integrals(self.res, self.jac, lhs=lhs) for lhs in self.lhsvals]
+    for lhs, (res, jac) in zip(self.lhsvals, desired):
+      actual = sample.eval_integrals(self.res, self.jac, lhs=lhs)
+      self.assertAllAlmostEqual(actual[0], res)
+      self.assertAllAlmostEqual(actual[1].export('dense'), jac.export('dense'))
+      self.assertEqual(len(sample._patterncache), 1)
+
+  def test_noraw(self):
+    with sample.patterncache(0):
+      desired = sample.eval_integrals(self.res, self.jac, lhs=self.lhsvals[0])
+    with unittest.mock.patch.object(sample.Sample, '_integrate_batches', side_effect=AssertionError('raw sparse data was formed')):
+      actual = sample.eval_integrals(self.res, self.jac, lhs=self.lhsvals[0])
+    self.assertAllAlmostEqual(actual[0], desired[0])
+    self.assertAllAlmostEqual(actual[1].export('dense'), desired[1].export('dense'))
+
+  def test_sparse(self):
+    data, = sample.eval_integrals_sparse(self.jac, lhs=self.lhsvals[0])
+    self.assertEqual(len(sample._patterncache), 1)
+    data, = sample.eval_integrals_sparse(self.jac, lhs=self.lhsvals[0])
+    index = data['index']
+    self.assertTrue((index[1:] != index[:-1]).all()) # deduplicated
+    self.assertEqual(numpy.lexsort(sparse.indices(data)[::-1]).tolist(), list(range(len(data)))) # sorted
+    self.assertAllAlmostEqual(sparse.toarray(data), self.jac.eval(lhs=self.lhsvals[0]).export('dense'))
+
+  def test_disable(self):
+    with sample.patterncache(0):
+      self.assertIsNone(sample._patterncache)
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      with sample.patterncache(-1):
+        pass
+
+
 class integral(TestCase):
 
   def setUp(self):
@@ -1,4 +1,4 @@
-import unittest, numpy, contextlib
+import unittest, numpy, contextlib, tempfile
 from nutils import sparse
 
 
@@ -193,3 +193,72 @@ class matrix(unittest.TestCase):
     self.assertEqual(retval.dtype, other.dtype)
     self.assertEqual(retval.tolist(),
       [((2,4),10), ((3,4),20), ((2,3),1), ((1,2),30), ((0,1),40), ((1,2),50), ((2,3),-1), ((3,0),0), ((2,0),60), ((0,1),-40), ((0,2),.5)])
+
+class largeshape(unittest.TestCase):
+
+  def setUp(self):
+    n = 2**40 # shape exceeds the range of linearized int64 keys
+    self.data = numpy.array([
+      ((2,n-1), 10),
+      ((n-1,4), 20),
+      ((2,n-1),  1),
+      ((0,1), 40)], dtype=sparse.dtype([n,n], int))
+
+  def test_dedup(self):
+    for inplace in False, True:
+      with self.subTest(inplace=inplace):
+        dedup = sparse.dedup(self.data.copy(), inplace=inplace)
+        self.assertEqual(dedup.tolist(),
+          [((0,1),40), ((2,2**40-1),11), ((2**40-1,4),20)])
+
+class dedup(unittest.TestCase):
+
+  def test_random(self):
+    numpy.random.seed(0)
+    data = numpy.empty(1000, dtype=sparse.dtype([7,300,5]))
+    for i, n in enumerate([7,300,5]):
+      data['index']['i'+str(i)] = numpy.random.randint(n, size=len(data))
+    data['value'] = numpy.random.normal(size=len(data))
+    desired = numpy.zeros([7,300,5])
+    numpy.add.at(desired, sparse.indices(data), data['value'])
+    for inplace in False, True:
+      with self.subTest(inplace=inplace):
+        dedup = sparse.dedup(data.copy(), inplace=inplace)
+        keys = numpy.ravel_multi_index(sparse.indices(dedup), [7,300,5])
+        self.assertTrue((keys[1:] > keys[:-1]).all())
+        numpy.testing.assert_allclose(sparse.toarray(dedup), desired, rtol=1e-14)
+
+  def test_sorted(self):
+    data = numpy.array([((0,1),1), ((0,3),2), ((2,0),3)], dtype=sparse.dtype([3,4]))
+    self.assertIs(sparse.dedup(data), data)
+    self.assertEqual(data.tolist(), [((0,1),1), ((0,3),2), ((2,0),3)])
+
+  def test_runs(self):
+    numpy.random.seed(0)
+    datas = []
+    for i in range(3):
+      data = numpy.empty(100, dtype=sparse.dtype([7,5]))
+      data['index']['i0'] = numpy.random.randint(7, size=len(data))
+      data['index']['i1'] = numpy.random.randint(5, size=len(data))
+      data['value'] = numpy.random.normal(size=len(data))
+      datas.append(sparse.dedup(data, inplace=True))
+    desired = sum(sparse.toarray(data) for data in datas)
+    dedup = sparse.dedup(sparse.add(datas), inplace=True)
+    keys = numpy.ravel_multi_index(sparse.indices(dedup), [7,5])
+    self.assertTrue((keys[1:] > keys[:-1]).all())
+    numpy.testing.assert_allclose(sparse.toarray(dedup), desired, rtol=1e-14)
+
+  def test_memmap(self):
+    data = numpy.array([((2,1),1), ((0,3),2), ((2,1),3)], dtype=sparse.dtype([3,4]))
+    with tempfile.TemporaryFile() as f:
+      mapped = numpy.memmap(f, dtype=data.dtype, mode='w+', shape=data.shape)
+      for inplace in False, True:
+        with self.subTest(inplace=inplace):
+          mapped[...] = data
+          dedup = sparse.dedup(mapped, inplace=inplace)
+          self.assertEqual(dedup.tolist(), [((0,3),2), ((2,1),4)])
+
+  def test_toarray_chunked(self):
+    data = numpy.array([((2,1),1), ((0,3),2), ((2,1),3)], dtype=sparse.dtype([3,4]))
+    with chunksize(data.itemsize * 2):
+      self.assertEqual(sparse.toarray(data).tolist(), [[0,0,0,2],[0,0,0,0],[0,4,0,0]])